@@ -0,0 +1,197 @@
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from typing import Dict, List
+from urllib.parse import parse_qs
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from benchmarks.tokens import TokenSigner
+from setup.products import subscriptions
+
+
+class UpstreamFaults:
+	"""Latency and error rate injected into every call a stand-in server answers."""
+
+	def __init__(self, latency_ms: float = 0, error_rate: float = 0.0):
+		self.latency_ms = latency_ms
+		self.error_rate = error_rate
+
+
+def _instrument(app: FastAPI, faults: UpstreamFaults, error_body: Dict) -> Counter:
+	calls = Counter()
+
+	@app.middleware("http")
+	async def inject_faults(request: Request, call_next):
+		if request.url.path.startswith("/__bench"):
+			return await call_next(request)
+		# Count per resource, ignoring ids: "GET /v1/customers", "PATCH /api/v2/users"
+		resource = "/".join(request.url.path.split("/")[:3 if request.url.path.startswith("/v1") else 4])
+		calls[f"{request.method} {resource}"] += 1
+		if faults.latency_ms:
+			await asyncio.sleep(faults.latency_ms / 1000)
+		if faults.error_rate and random.random() < faults.error_rate:
+			return JSONResponse(error_body, status_code=503)
+		return await call_next(request)
+
+	@app.get("/__bench/stats")
+	async def stats():
+		return {"total": sum(calls.values()), "calls": dict(calls)}
+
+	@app.post("/__bench/reset")
+	async def reset():
+		calls.clear()
+		return {"total": 0}
+
+	return calls
+
+
+def create_fake_auth0(signer: TokenSigner, faults: UpstreamFaults) -> FastAPI:
+	"""JWKS, client-credentials and Management API users endpoints of an Auth0 tenant."""
+	app = FastAPI()
+	_instrument(app, faults, {"statusCode": 503, "error": "Service Unavailable", "message": "Injected error"})
+	users: Dict[str, Dict] = {}
+
+	@app.get("/.well-known/jwks.json")
+	async def jwks():
+		return JSONResponse(signer.jwks, headers={"Cache-Control": "public, max-age=600"})
+
+	@app.post("/oauth/token")
+	async def token():
+		return {"access_token": f"mgmt-{time.time()}", "expires_in": 86400, "token_type": "Bearer"}
+
+	@app.get("/api/v2/users/{user_id}")
+	async def get_user(user_id: str):
+		user = users.setdefault(user_id, {
+			"user_id": user_id,
+			"email": f"{user_id.split('|')[-1]}@bench.local",
+			"given_name": "Bench",
+			"family_name": "User",
+			"app_metadata": {},
+		})
+		return user
+
+	@app.patch("/api/v2/users/{user_id}")
+	async def update_user(user_id: str, request: Request):
+		user = await get_user(user_id)
+		payload = await request.json()
+		user["app_metadata"].update(payload.get("app_metadata") or {})
+		user.setdefault("user_metadata", {}).update(payload.get("user_metadata") or {})
+		return user
+
+	return app
+
+
+def _catalog() -> List[Dict]:
+	prices = []
+	for subscription in subscriptions:
+		product = {
+			"id": f"prod_{subscription['code']}",
+			"object": "product",
+			"name": subscription["name"],
+			"description": subscription.get("description"),
+			"active": True,
+			"images": [],
+			"metadata": {key: json.dumps(value) for key, value in subscription.get("metadata", {}).items()},
+		}
+		for price in subscription["price"]:
+			prices.append({
+				"id": f"price_{price['price_id']}",
+				"object": "price",
+				"active": True,
+				"currency": price["currency"],
+				"unit_amount": price["amount"],
+				"recurring": {"interval": price["interval"]} if price.get("interval") else None,
+				"lookup_key": price["price_id"],
+				"metadata": {},
+				"product": product,
+			})
+	return prices
+
+
+def create_fake_stripe(faults: UpstreamFaults) -> FastAPI:
+	"""The subset of the Stripe API the plugin calls, answering with minimal but well-formed objects."""
+	app = FastAPI()
+	_instrument(app, faults, {"error": {"type": "api_error", "message": "Injected error"}})
+	prices = _catalog()
+	ids = itertools.count(1)
+
+	def empty_list(url: str) -> Dict:
+		return {"object": "list", "url": url, "has_more": False, "data": []}
+
+	async def form(request: Request) -> Dict[str, str]:
+		return {key: values[-1] for key, values in parse_qs((await request.body()).decode()).items()}
+
+	@app.get("/v1/prices")
+	async def list_prices():
+		return {"object": "list", "url": "/v1/prices", "has_more": False, "data": prices}
+
+	@app.post("/v1/customers")
+	async def create_customer(request: Request):
+		data = await form(request)
+		return {"id": f"cus_bench{next(ids)}", "object": "customer", "email": data.get("email"), "metadata": {}}
+
+	@app.get("/v1/customers/{customer_id}")
+	async def retrieve_customer(customer_id: str):
+		return {"id": customer_id, "object": "customer", "metadata": {}}
+
+	@app.post("/v1/checkout/sessions")
+	async def create_checkout_session(request: Request):
+		data = await form(request)
+		session_id = f"cs_bench{next(ids)}"
+		return {
+			"id": session_id,
+			"object": "checkout.session",
+			"customer": data.get("customer"),
+			"url": f"https://checkout.stripe.com/c/pay/{session_id}",
+			"expires_at": int(time.time()) + 24 * 3600,
+		}
+
+	@app.post("/v1/billing_portal/sessions")
+	async def create_portal_session(request: Request):
+		data = await form(request)
+		session_id = f"bps_bench{next(ids)}"
+		return {
+			"id": session_id,
+			"object": "billing_portal.session",
+			"customer": data.get("customer"),
+			"url": f"https://billing.stripe.com/p/session/{session_id}",
+		}
+
+	@app.get("/v1/subscriptions")
+	async def list_subscriptions():
+		return empty_list("/v1/subscriptions")
+
+	@app.get("/v1/invoices")
+	async def list_invoices():
+		return empty_list("/v1/invoices")
+
+	return app
+
+
+class BackgroundServer:
+	"""Runs an ASGI app with uvicorn on a daemon thread."""
+
+	def __init__(self, app: FastAPI, port: int):
+		self.port = port
+		self.url = f"http://127.0.0.1:{port}"
+		self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+		self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+	def __enter__(self) -> "BackgroundServer":
+		self.thread.start()
+		while not self.server.started:
+			if not self.thread.is_alive():
+				raise RuntimeError(f"Stand-in server on port {self.port} failed to start")
+			time.sleep(0.01)
+		return self
+
+	def __exit__(self, *exc_info):
+		self.server.should_exit = True
+		self.thread.join(timeout=5)
@@ -0,0 +1,261 @@
+"""
+Offline latency/throughput benchmark of the plugin API.
+
+Starts stand-in Auth0 and Stripe servers, runs the application with uvicorn against them and drives each
+scenario at a fixed concurrency. Results are written to benchmarks/results/ and can be compared with an
+earlier run:
+
+	python -m benchmarks.run --concurrency 20 --requests 500 --latency-ms 50
+	python -m benchmarks.run --compare benchmarks/results/<earlier-run>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.fakes import BackgroundServer, UpstreamFaults, create_fake_auth0, create_fake_stripe
+from benchmarks.tokens import TokenSigner
+
+ROOT = Path(__file__).parent.parent
+RESULTS_DIR = Path(__file__).parent / "results"
+
+AUTH0_DOMAIN = "bench.auth0.local"
+API_IDENTIFIER = "https://bench.robofast.local/api"
+
+# name -> (method, path, authenticated)
+SCENARIOS = {
+	"healthcheck": ("GET", "/healthcheck", False),
+	"manifest": ("GET", "/.well-known/ai-plugin.json", False),
+	"subscriptions": ("GET", "/payment/subscriptions", False),
+	"payment_link": ("POST", "/payment/payment-link", True),
+	"customer_portal": ("POST", "/payment/customer-portal", True),
+}
+
+
+def free_port() -> int:
+	with socket.socket() as sock:
+		sock.bind(("127.0.0.1", 0))
+		return sock.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+	if not sorted_values:
+		return 0.0
+	index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+	return sorted_values[index]
+
+
+def git_commit() -> Optional[str]:
+	try:
+		return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+class PluginProcess:
+	"""The application under test, run by uvicorn in a subprocess and pointed at the stand-in servers."""
+
+	def __init__(self, auth0_url: str, stripe_url: str, port: int, store_path: str):
+		self.url = f"http://127.0.0.1:{port}"
+		self.command = [
+			sys.executable, "-m", "uvicorn", "src.app.plugin:app",
+			"--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+		]
+		self.env = {
+			**os.environ,
+			"APP_ENVIRONMENT": "BENCHMARK",
+			"APP_LOG_LEVEL": "WARNING",
+			"APP_BASE_URL": self.url,
+			"APP_STATE_SECRET_KEY": "benchmark",
+			"APP_AUTH0_DOMAIN": AUTH0_DOMAIN,
+			"APP_AUTH0_BASE_URL": auth0_url,
+			"APP_AUTH0_CLIENT_ID": "benchmark",
+			"APP_AUTH0_CLIENT_SECRET": "benchmark",
+			"APP_AUTH0_API_IDENTIFIER": API_IDENTIFIER,
+			"APP_AUTH0_MGM_CLIENT_ID": "benchmark",
+			"APP_AUTH0_MGM_CLIENT_SECRET": "benchmark",
+			"APP_CHATGPT_AUTH_TOKEN": "benchmark",
+			"APP_STRIPE_SECRET_KEY": "sk_test_benchmark",
+			"APP_STRIPE_API_BASE": stripe_url,
+			"APP_LOCAL_STORE_PATH": store_path,
+			# Every run starts cold
+			"APP_SNAPSHOT_PATH": "",
+			# The stand-in tenant has no rate limit, so the governor should not add waits of its own
+			"APP_AUTH0_MGM_RATE_LIMIT": "1000",
+			"APP_AUTH0_MGM_RATE_BURST": "1000",
+		}
+		self.process: Optional[subprocess.Popen] = None
+
+	def __enter__(self) -> "PluginProcess":
+		self.process = subprocess.Popen(self.command, cwd=ROOT, env=self.env)
+		deadline = time.monotonic() + 60
+		while time.monotonic() < deadline:
+			if self.process.poll() is not None:
+				raise RuntimeError("The application exited during startup")
+			try:
+				if httpx.get(f"{self.url}/healthcheck", timeout=1).status_code == 200:
+					return self
+			except httpx.HTTPError:
+				pass
+			time.sleep(0.1)
+		raise RuntimeError("The application did not become healthy within 60s")
+
+	def __exit__(self, *exc_info):
+		self.process.terminate()
+		self.process.wait(timeout=10)
+
+
+async def upstream_calls(client: httpx.AsyncClient, servers: Dict[str, str], reset: bool = False) -> Dict[str, Dict]:
+	stats = {}
+	for name, url in servers.items():
+		if reset:
+			await client.post(f"{url}/__bench/reset")
+		else:
+			stats[name] = (await client.get(f"{url}/__bench/stats")).json()
+	return stats
+
+
+async def run_scenario(
+		client: httpx.AsyncClient, app_url: str, scenario: str, tokens: List[str], price_id: str,
+		requests: int, concurrency: int
+) -> Dict[str, object]:
+	method, path, authenticated = SCENARIOS[scenario]
+	latencies: List[float] = []
+	statuses: Dict[str, int] = {}
+	counter = iter(range(requests))
+
+	async def worker():
+		for index in counter:
+			headers = {"Authorization": f"Bearer {tokens[index % len(tokens)]}"} if authenticated else {}
+			body = {"price_id": price_id} if scenario == "payment_link" else None
+			started = time.perf_counter()
+			try:
+				response = await client.request(method, f"{app_url}{path}", headers=headers, json=body)
+				status = str(response.status_code)
+			except httpx.HTTPError as e:
+				status = type(e).__name__
+			latencies.append((time.perf_counter() - started) * 1000)
+			statuses[status] = statuses.get(status, 0) + 1
+
+	started = time.perf_counter()
+	await asyncio.gather(*(worker() for _ in range(concurrency)))
+	elapsed = time.perf_counter() - started
+
+	latencies.sort()
+	return {
+		"requests": requests,
+		"concurrency": concurrency,
+		"statuses": statuses,
+		"rps": round(requests / elapsed, 1),
+		"p50_ms": round(percentile(latencies, 0.50), 2),
+		"p95_ms": round(percentile(latencies, 0.95), 2),
+		"p99_ms": round(percentile(latencies, 0.99), 2),
+		"max_ms": round(latencies[-1], 2),
+	}
+
+
+async def run_benchmark(args, app_url: str, servers: Dict[str, str], signer: TokenSigner) -> Dict[str, Dict]:
+	tokens = [signer.sign(f"auth0|bench-user-{index}") for index in range(args.users)]
+	limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+	results = {}
+	async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+		catalog = (await client.get(f"{app_url}/payment/subscriptions")).json()
+		price_id = catalog["subscriptions"][0]["prices"][0]["price_id"]
+
+		for scenario in args.scenarios:
+			if args.warmup:
+				await run_scenario(client, app_url, scenario, tokens, price_id, args.warmup, args.concurrency)
+			await upstream_calls(client, servers, reset=True)
+			result = await run_scenario(
+				client, app_url, scenario, tokens, price_id, args.requests, args.concurrency
+			)
+			calls = await upstream_calls(client, servers)
+			result["upstream_calls_per_request"] = {
+				name: round(stats["total"] / args.requests, 3) for name, stats in calls.items()
+			}
+			result["upstream_calls"] = {name: stats["calls"] for name, stats in calls.items()}
+			results[scenario] = result
+			print(
+				f"{scenario:<16} rps={result['rps']:>8} p50={result['p50_ms']:>8}ms p95={result['p95_ms']:>8}ms "
+				f"p99={result['p99_ms']:>8}ms upstream/req={result['upstream_calls_per_request']} "
+				f"statuses={result['statuses']}"
+			)
+	return results
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+	"""
+	Print the change against a baseline run and return the regressions beyond `threshold` (a fraction).
+	"""
+	regressions = []
+	print(f"\nCompared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+	for scenario, result in current["scenarios"].items():
+		before = baseline["scenarios"].get(scenario)
+		if before is None:
+			continue
+		changes = []
+		for metric, higher_is_worse in (("p50_ms", True), ("p95_ms", True), ("p99_ms", True), ("rps", False)):
+			old, new = before[metric], result[metric]
+			delta = (new - old) / old if old else 0.0
+			changes.append(f"{metric} {old} -> {new} ({delta:+.0%})")
+			if (delta > threshold) if higher_is_worse else (delta < -threshold):
+				regressions.append(f"{scenario} {metric}: {old} -> {new}")
+		print(f"  {scenario:<16} " + ", ".join(changes))
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+	parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+	parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests before each scenario")
+	parser.add_argument("--concurrency", type=int, default=20)
+	parser.add_argument("--users", type=int, default=50, help="distinct signed-in users the requests rotate through")
+	parser.add_argument("--latency-ms", type=float, default=50, help="latency injected into every upstream call")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls answered with 503")
+	parser.add_argument("--compare", type=Path, help="earlier result file to compare with")
+	parser.add_argument("--threshold", type=float, default=0.10, help="allowed regression before failing")
+	parser.add_argument("--output", type=Path, help="where to store the results")
+	args = parser.parse_args()
+
+	faults = UpstreamFaults(latency_ms=args.latency_ms, error_rate=args.error_rate)
+	signer = TokenSigner(issuer=f"https://{AUTH0_DOMAIN}/", audience=API_IDENTIFIER)
+
+	with tempfile.TemporaryDirectory() as state_dir, \
+			BackgroundServer(create_fake_auth0(signer, faults), free_port()) as auth0, \
+			BackgroundServer(create_fake_stripe(faults), free_port()) as stripe_server, \
+			PluginProcess(auth0.url, stripe_server.url, free_port(), f"{state_dir}/store.sqlite3") as plugin:
+		servers = {"auth0": auth0.url, "stripe": stripe_server.url}
+		scenarios = asyncio.run(run_benchmark(args, plugin.url, servers, signer))
+
+	results = {
+		"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"commit": git_commit(),
+		"config": {
+			key: getattr(args, key) for key in ("requests", "warmup", "concurrency", "users", "latency_ms", "error_rate")
+		},
+		"scenarios": scenarios,
+	}
+	output = args.output or RESULTS_DIR / f"{results['timestamp'].replace(':', '')}-{results['commit']}.json"
+	output.parent.mkdir(parents=True, exist_ok=True)
+	output.write_text(json.dumps(results, indent=2))
+	print(f"\nResults written to {output}")
+
+	if args.compare:
+		regressions = compare(results, json.loads(args.compare.read_text()), args.threshold)
+		if regressions:
+			print("\nRegressions:\n  " + "\n  ".join(regressions))
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,30 @@
+import time
+from typing import Dict
+
+import rsa
+from jose import jwk, jwt
+
+
+class TokenSigner:
+	"""Local RS256 key pair that signs Auth0-like access tokens and publishes the matching JWKS."""
+
+	def __init__(self, issuer: str, audience: str, kid: str = "bench-key"):
+		self.issuer = issuer
+		self.audience = audience
+		self.kid = kid
+		public_key, private_key = rsa.newkeys(2048)
+		self.private_pem = private_key.save_pkcs1().decode()
+		public_jwk = jwk.construct(public_key.save_pkcs1().decode(), algorithm="RS256").to_dict()
+		self.jwks = {"keys": [{**public_jwk, "kid": kid, "use": "sig", "alg": "RS256"}]}
+
+	def sign(self, sub: str, expires_in: int = 3600) -> str:
+		now = int(time.time())
+		claims: Dict[str, object] = {
+			"iss": self.issuer,
+			"sub": sub,
+			"aud": self.audience,
+			"iat": now,
+			"exp": now + expires_in,
+			"scope": "openid email offline_access",
+		}
+		return jwt.encode(claims, self.private_pem, algorithm="RS256", headers={"kid": self.kid})
@@ -0,0 +1,31 @@
+import argparse
+import asyncio
+
+from src.core.config import settings
+from src.helpers.authentication import Auth0UserManagement
+from src.helpers.store import subscription_store
+from src.helpers.user_import import Auth0UserImport
+
+
+async def import_users(source: str = "auto", batch_size: int = 500):
+	# Load the Stripe customer id of every Auth0 user into LOCAL_STORE_PATH
+	auth0_manager = Auth0UserManagement()
+	try:
+		result = await Auth0UserImport(subscription_store, auth0_manager, batch_size=batch_size).run(source)
+	finally:
+		await auth0_manager.aclose()
+		subscription_store.close()
+	print(result.describe())
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Import the Stripe customer ids stored in Auth0 into the local store")
+	parser.add_argument(
+		"--source", choices=("auto", "search", "export"), default="auto",
+		help="user search (up to 1000 users), users export job, or pick by the number of users"
+	)
+	parser.add_argument(
+		"--batch-size", type=int, default=settings.USER_IMPORT_BATCH_SIZE, help="mappings written per transaction"
+	)
+	args = parser.parse_args()
+	asyncio.run(import_users(source=args.source, batch_size=args.batch_size))
@@ -1,13 +1,26 @@
-from setup.stripe import StripeProductPriceManager
+import argparse
+
+from setup.stripe import StripeCatalogSync
 from setup.products import subscriptions
 from src.core.config import settings
 
 
-def setup():
-	# Create Subscriptions and Prices
-	stripe_manager = StripeProductPriceManager(api_key=settings.STRIPE_SECRET_KEY)
-	subscription_plan = stripe_manager.create_products_and_prices(subscriptions=subscriptions)
+def setup(dry_run: bool = False, concurrency: int = 8):
+	# Create, update or archive Subscriptions and Prices so Stripe matches setup/products.py
+	catalog_sync = StripeCatalogSync(api_key=settings.STRIPE_SECRET_KEY, concurrency=concurrency)
+	changes = catalog_sync.sync(subscriptions=subscriptions, dry_run=dry_run)
+
+	if not changes:
+		print("Stripe catalog is up to date.")
+	for change in changes:
+		print(change.describe())
+	if dry_run and changes:
+		print(f"Dry run: {len(changes)} change(s) not applied.")
 
 
 if __name__ == '__main__':
-	setup()
+	parser = argparse.ArgumentParser(description="Sync the Stripe catalog with setup/products.py")
+	parser.add_argument("--dry-run", action="store_true", help="only print the changes that would be made")
+	parser.add_argument("--concurrency", type=int, default=8, help="Stripe calls in flight at once")
+	args = parser.parse_args()
+	setup(dry_run=args.dry_run, concurrency=args.concurrency)
@@ -1,6 +1,7 @@
 import json
 import stripe
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 
 class StripeProductPriceManager:
@@ -60,3 +61,225 @@ class StripeProductPriceManager:
 
 		return created_subscriptions
 
+
+
+class CatalogChange(NamedTuple):
+	action: str  # "create", "update" or "archive"
+	kind: str  # "product" or "price"
+	key: str  # product code or price lookup key
+	params: Dict[str, Any]
+	stripe_id: Optional[str] = None
+	product_code: Optional[str] = None  # prices only: the product they belong to
+	reason: str = ""
+
+	def describe(self) -> str:
+		symbol = {"create": "+", "update": "~", "archive": "-"}[self.action]
+		line = f"{symbol} {self.kind} {self.key}"
+		if self.stripe_id:
+			line += f" ({self.stripe_id})"
+		if self.params and self.action != "archive":
+			line += ": " + ", ".join(f"{key}={value!r}" for key, value in self.params.items() if key != "product")
+		if self.reason:
+			line += f" [{self.reason}]"
+		return line
+
+
+class StripeCatalogSync:
+	"""
+	Brings the Stripe catalog in line with setup/products.py.
+
+	Products are matched on their `code` metadata (or, for products created before codes were stored, their
+	name) and prices on their lookup key, which is the `price_id` of products.py. Only the differences are
+	applied: missing entries are created, changed ones updated, and entries no longer listed are archived.
+	Uncoded products sharing the name of a listed one are archived as duplicates, along with their prices.
+	Prices are immutable in Stripe, so a changed amount, currency or interval creates a new price that takes
+	over the lookup key while the old one is archived.
+	"""
+
+	def __init__(self, api_key: str, concurrency: int = 8):
+		stripe.api_key = api_key
+		self.concurrency = concurrency
+
+	@staticmethod
+	def fetch_catalog() -> Tuple[List, List]:
+		"""All products and prices, active or not, each listed in a single paginated pass."""
+		with ThreadPoolExecutor(max_workers=2) as pool:
+			products = pool.submit(lambda: list(stripe.Product.list(limit=100).auto_paging_iter()))
+			prices = pool.submit(lambda: list(stripe.Price.list(limit=100).auto_paging_iter()))
+			return products.result(), prices.result()
+
+	@staticmethod
+	def _metadata_changes(current, desired: Dict[str, str]) -> Dict[str, str]:
+		current = current or {}
+		return {key: value for key, value in desired.items() if current.get(key) != value}
+
+	@staticmethod
+	def _same_terms(existing, price: Dict) -> bool:
+		"""Whether an existing Stripe price has the immutable terms of a products.py price."""
+		interval = existing.recurring.interval if existing.recurring else None
+		return (
+			existing.currency == price["currency"] and existing.unit_amount == price["amount"]
+			and interval == price.get("interval")
+		)
+
+	def plan(self, subscriptions: List[Dict], products: List, prices: List) -> List[CatalogChange]:
+		changes: List[CatalogChange] = []
+		products_by_code = {product.metadata.get("code"): product for product in products if product.metadata.get("code")}
+		# The old blind create could leave several uncoded products with the same name
+		products_by_name: Dict[str, List] = {}
+		for product in products:
+			if not product.metadata.get("code"):
+				products_by_name.setdefault(product.name, []).append(product)
+		prices_by_lookup_key = {price.lookup_key: price for price in prices if price.lookup_key}
+		prices_by_product: Dict[str, List] = {}
+		for price in prices:
+			prices_by_product.setdefault(price.product, []).append(price)
+
+		codes = set()
+		claimed_prices = set()
+		for subscription in subscriptions:
+			code = subscription["code"]
+			codes.add(code)
+			limit_info = subscription.get("limits", {})
+			desired = {
+				"name": subscription["name"],
+				"description": subscription.get("description"),
+				"metadata": StripeProductPriceManager.serialize_metadata(
+					{**limit_info, **subscription.get("metadata", {}), "code": code}
+				),
+			}
+
+			# Adopt one uncoded product of that name, preferring an active one, then the oldest
+			same_name = sorted(
+				products_by_name.get(subscription["name"], []),
+				key=lambda candidate: (not candidate.active, getattr(candidate, "created", 0)),
+			)
+			product = products_by_code.get(code) or (same_name[0] if same_name else None)
+			duplicates = [candidate for candidate in same_name if candidate is not product]
+			if product is None:
+				changes.append(CatalogChange("create", "product", code, desired))
+			else:
+				update = {key: desired[key] for key in ("name", "description") if getattr(product, key) != desired[key]}
+				metadata = self._metadata_changes(product.metadata, desired["metadata"])
+				if metadata:
+					update["metadata"] = metadata
+				if not product.active:
+					update["active"] = True
+				if update:
+					changes.append(CatalogChange("update", "product", code, update, stripe_id=product.id))
+
+			product_prices = prices_by_product.get(product.id, []) if product is not None else []
+			for price in subscription["price"]:
+				lookup_key = price["price_id"]
+				recurring = {"interval": price["interval"]} if price.get("interval") else None
+				desired_price = {
+					"currency": price["currency"],
+					"unit_amount": price["amount"],
+					"recurring": recurring,
+					"metadata": StripeProductPriceManager.serialize_metadata({**limit_info, **price.get("metadata", {})}),
+					"lookup_key": lookup_key,
+				}
+
+				existing = prices_by_lookup_key.get(lookup_key)
+				if existing is None:
+					# Prices created before lookup keys were set: adopt one with the same terms
+					existing = next((
+						candidate for candidate in sorted(product_prices, key=lambda candidate: not candidate.active)
+						if not candidate.lookup_key and candidate.id not in claimed_prices and self._same_terms(candidate, price)
+					), None)
+
+				if existing is None:
+					changes.append(CatalogChange("create", "price", lookup_key, desired_price, product_code=code))
+					continue
+
+				claimed_prices.add(existing.id)
+				if product is None or existing.product != product.id or not self._same_terms(existing, price):
+					changes.append(CatalogChange(
+						"create", "price", lookup_key, {**desired_price, "transfer_lookup_key": True}, product_code=code,
+						reason=f"replaces {existing.id}",
+					))
+					if existing.active:
+						changes.append(CatalogChange("archive", "price", lookup_key, {}, stripe_id=existing.id))
+					continue
+
+				update = {}
+				if existing.lookup_key != lookup_key:
+					update["lookup_key"] = lookup_key
+				metadata = self._metadata_changes(existing.metadata, desired_price["metadata"])
+				if metadata:
+					update["metadata"] = metadata
+				if not existing.active:
+					update["active"] = True
+				if update:
+					changes.append(CatalogChange("update", "price", lookup_key, update, stripe_id=existing.id))
+
+			# Prices of a managed product that products.py no longer lists
+			for price in product_prices:
+				if price.active and price.id not in claimed_prices:
+					changes.append(CatalogChange(
+						"archive", "price", price.lookup_key or price.id, {}, stripe_id=price.id, reason="not in products.py"
+					))
+
+			for duplicate in duplicates:
+				reason = f"duplicate of {code}"
+				if duplicate.active:
+					changes.append(CatalogChange("archive", "product", code, {}, stripe_id=duplicate.id, reason=reason))
+				for price in prices_by_product.get(duplicate.id, []):
+					# Claimed prices were already replaced above
+					if price.active and price.id not in claimed_prices:
+						changes.append(CatalogChange(
+							"archive", "price", price.lookup_key or price.id, {}, stripe_id=price.id, reason=reason
+						))
+
+		for code, product in products_by_code.items():
+			if code not in codes and product.active:
+				changes.append(CatalogChange(
+					"archive", "product", code, {}, stripe_id=product.id, reason="not in products.py"
+				))
+				for price in prices_by_product.get(product.id, []):
+					if price.active:
+						changes.append(CatalogChange(
+							"archive", "price", price.lookup_key or price.id, {}, stripe_id=price.id, reason=f"product {code} archived"
+						))
+
+		return changes
+
+	@staticmethod
+	def _apply_change(change: CatalogChange):
+		resource = stripe.Product if change.kind == "product" else stripe.Price
+		if change.action == "create":
+			return resource.create(**change.params)
+		if change.action == "update":
+			return resource.modify(change.stripe_id, **change.params)
+		return resource.modify(change.stripe_id, active=False)
+
+	def apply(self, changes: List[CatalogChange], products: List) -> List:
+		"""
+		Apply the product changes, then the price changes, each group concurrently with at most `concurrency`
+		calls in flight. New prices need the id of their product, hence the two steps.
+		"""
+		product_ids = {product.metadata.get("code") or product.name: product.id for product in products}
+		product_changes = [change for change in changes if change.kind == "product"]
+		price_changes = [change for change in changes if change.kind == "price"]
+
+		with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+			results = list(pool.map(self._apply_change, product_changes))
+			for change, result in zip(product_changes, results):
+				# Archived duplicates share the code of the product that is kept
+				if change.action != "archive":
+					product_ids[change.key] = result.id
+
+			price_changes = [
+				change._replace(params={**change.params, "product": product_ids[change.product_code]})
+				if change.action == "create" else change
+				for change in price_changes
+			]
+			results += list(pool.map(self._apply_change, price_changes))
+		return results
+
+	def sync(self, subscriptions: List[Dict], dry_run: bool = False) -> List[CatalogChange]:
+		products, prices = self.fetch_catalog()
+		changes = self.plan(subscriptions, products, prices)
+		if not dry_run and changes:
+			self.apply(changes, products)
+		return changes
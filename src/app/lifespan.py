@@ -0,0 +1,117 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from fastapi import FastAPI
+
+from src.core.config import settings, logger
+from src.core.openapi import build_openapi_documents
+from src.core.startup import startup_report
+from src.core.static import static_assets
+from src.endpoints.payment import build_payment_documents
+from src.endpoints.plugin import build_plugin_documents
+from src.helpers.catalog import catalog_cache
+from src.helpers.jwks import jwks_cache
+from src.helpers.payment import StripeWithAuth0, stripe_executor
+from src.helpers.snapshot import warm_start_snapshot
+from src.helpers.store import subscription_store
+from src.helpers.user_import import Auth0UserImport
+
+
+async def _warm_up_component(component: str, coroutine, restored: bool = False):
+	started = time.perf_counter()
+	try:
+		await coroutine
+		if not restored:
+			startup_report.record("warm-up", component, time.perf_counter() - started)
+	except Exception as e:
+		if restored:
+			logger.warning("Refresh of the restored %s failed, serving the snapshot copy: %s", component, e)
+			return
+		logger.warning("Warm-up of %s failed, it will be loaded on first use: %s", component, e)
+		startup_report.record("warm-up", component, time.perf_counter() - started, f"failed: {type(e).__name__}")
+
+
+async def warm_up(app: FastAPI, restored: Dict[str, bool]):
+	"""
+	Fill the JWKS, catalog and management-token caches concurrently.
+
+	Startup waits at most WARMUP_TIMEOUT seconds; whatever is still running then finishes in the background
+	and the first requests simply join it. Caches restored from the warm-start snapshot already serve requests,
+	so their refresh is not waited for at all. Unfinished tasks are kept in app.state.warm_up_tasks until done.
+	"""
+	components = {
+		"jwks": jwks_cache.refresh(),
+		"catalog": catalog_cache.refresh(),
+		"management_token": app.state.stripe_with_auth0.auth0_manager.get_token(),
+	}
+	tasks = {}
+	for component, coroutine in components.items():
+		task = asyncio.create_task(_warm_up_component(component, coroutine, restored.get(component, False)))
+		# The loop only keeps weak references to tasks
+		app.state.warm_up_tasks.add(task)
+		task.add_done_callback(app.state.warm_up_tasks.discard)
+		if restored.get(component):
+			startup_report.record("warm-up", component, 0, "restored, refreshing in background")
+		else:
+			tasks[task] = component
+	if not tasks:
+		return
+	_, pending = await asyncio.wait(tasks, timeout=settings.WARMUP_TIMEOUT)
+	for task in pending:
+		startup_report.record("warm-up", tasks[task], settings.WARMUP_TIMEOUT, "still running")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	"""
+	Build what holds upstream connections, StripeWithAuth0 and the user import, and the pre-rendered documents
+	onto app.state, where endpoints read them. The process-wide caches, subscription store and Stripe executor stay
+	module singletons, imported directly; they do no I/O until used, and are only opened, warmed and closed here.
+	"""
+	with startup_report.measure("init", "stripe_with_auth0"):
+		app.state.stripe_with_auth0 = StripeWithAuth0()
+	with startup_report.measure("init", "subscription_store"):
+		subscription_store.connection
+	# Read from disk and compressed here rather than at import
+	with startup_report.measure("init", "static_assets"):
+		static_assets.load()
+	with startup_report.measure("init", "plugin_documents"):
+		documents = build_plugin_documents()
+	with startup_report.measure("init", "payment_documents"):
+		documents.update(build_payment_documents())
+	app.state.documents = documents
+	with startup_report.measure("init", "openapi_documents"):
+		app.state.openapi_json, app.state.openapi_yaml = build_openapi_documents(app)
+
+	warm_start_snapshot.register("jwks", jwks_cache)
+	warm_start_snapshot.register("catalog", catalog_cache)
+	warm_start_snapshot.register("customer_ids", app.state.stripe_with_auth0)
+	with startup_report.measure("init", "warm_start_snapshot"):
+		restored = warm_start_snapshot.restore()
+
+	app.state.warm_up_tasks = set()
+	await warm_up(app, restored)
+	warm_start_snapshot.start()
+	app.state.stripe_with_auth0.metadata_outbox.start()
+	app.state.user_import = Auth0UserImport(
+		subscription_store, app.state.stripe_with_auth0.auth0_manager, batch_size=settings.USER_IMPORT_BATCH_SIZE
+	)
+	app.state.user_import.start(interval=settings.USER_IMPORT_INTERVAL)
+	app.state.startup_report = startup_report
+	startup_report.log()
+
+	yield
+
+	logger.info("Shutting down: saving the warm-start snapshot, draining the outbox and closing upstream clients")
+	await app.state.user_import.stop()
+	for task in list(app.state.warm_up_tasks):
+		task.cancel()
+	await asyncio.gather(*app.state.warm_up_tasks, return_exceptions=True)
+	await warm_start_snapshot.stop()
+	await app.state.stripe_with_auth0.metadata_outbox.stop(timeout=settings.AUTH0_OUTBOX_SHUTDOWN_TIMEOUT)
+	await app.state.stripe_with_auth0.auth0_manager.aclose()
+	await jwks_cache.aclose()
+	stripe_executor.shutdown()
+	subscription_store.close()
@@ -1,12 +1,26 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.sessions import SessionMiddleware
+from src.core.startup import startup_report
 
-from src.routers.plugin import main_router
-from src.routers.payment import payment_router
+with startup_report.measure("import", "fastapi"):
+	from fastapi import FastAPI
+	from fastapi.middleware.cors import CORSMiddleware
+	from starlette.middleware.sessions import SessionMiddleware
+
+with startup_report.measure("import", "src.core.config"):
+	from src.core.config import settings, logger
+with startup_report.measure("import", "src.routers.plugin"):
+	from src.routers.plugin import main_router
+with startup_report.measure("import", "src.routers.payment"):
+	from src.routers.payment import payment_router
+with startup_report.measure("import", "src.app.lifespan"):
+	from src.app.lifespan import lifespan
+from src.core.admission import AdmissionControlMiddleware
+from src.core.log import RequestIdMiddleware
+from src.core.metrics import MetricsMiddleware
 from src.core.openapi import chatgpt_openapi
-from src.core.config import settings, logger
+from src.core.static import static_assets
+from src.endpoints.plugin import circuit_open_handler, rate_limit_exceeded_handler
+from src.helpers.circuit import CircuitOpenError
+from src.helpers.ratelimit import RateLimitExceeded
 
 origins = [
 	["*"],
@@ -16,17 +30,26 @@ app = FastAPI(
 	title=settings.OPENAPI_TITLE,
 	description=settings.OPENAPI_DESCRIPTION,
 	version=settings.OPENAPI_VERSION,
-	openapi_url=f"/{settings.OPENAPI_PATH}",
-	docs_url=f"/{settings.DOC_PATH}",
+	# Served from pre-encoded documents by main_router instead
+	openapi_url=None,
+	docs_url=None,
+	redoc_url=None,
 	debug=settings.DEBUG,
+	lifespan=lifespan,
 )
 
 logger.info("Creating routers")
 app.include_router(main_router, prefix="")
 app.include_router(payment_router)
 
+# Upstreams behind an open circuit breaker answer 503 with Retry-After
+app.add_exception_handler(CircuitOpenError, circuit_open_handler)
+# So do calls our own Auth0 rate governor would have to queue for too long
+app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
+
 logger.info("Mounting static files")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Files are served from memory, compressed, and immutable under their content-hashed URLs
+app.mount("/static", static_assets, name="static")
 
 logger.info("Overriding openapi generator")
 app.openapi = lambda: chatgpt_openapi(app)
@@ -42,4 +65,20 @@ app.add_middleware(
 	allow_methods=["*"],
 	allow_headers=["*"],
 )
+# Inside the metrics middleware, so shed requests are counted with their 503 under their route template
+logger.info("Adding admission control middleware")
+app.add_middleware(
+	AdmissionControlMiddleware,
+	limits=settings.ADMISSION_LIMITS,
+	default_limit=settings.ADMISSION_DEFAULT_LIMIT,
+	exempt_paths=settings.ADMISSION_EXEMPT_PATHS,
+	queue_size=settings.ADMISSION_QUEUE_SIZE,
+	queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+	retry_after=settings.ADMISSION_RETRY_AFTER,
+)
+# Outside every middleware but the request id one, so it times the whole request and logs with its id
+logger.info("Adding metrics middleware")
+app.add_middleware(MetricsMiddleware)
+logger.info("Adding request id middleware")
+app.add_middleware(RequestIdMiddleware)
 logger.info("FastAPI application created and configured")
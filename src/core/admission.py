@@ -0,0 +1,144 @@
+import asyncio
+import json
+from collections import deque
+from typing import Deque, Dict, Iterable
+
+from starlette.routing import Match
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from src.core.config import logger
+from src.core.metrics import metrics
+
+admission_in_flight = metrics.gauge(
+	"robofast_admission_in_flight", "Requests being handled, per admission-controlled route.", ("route",)
+)
+admission_queue_depth = metrics.gauge(
+	"robofast_admission_queue_depth", "Requests waiting for a slot, per admission-controlled route.", ("route",)
+)
+admission_shed = metrics.counter(
+	"robofast_admission_shed_total", "Requests answered 503 by admission control.", ("route", "reason")
+)
+
+QUEUE_FULL = "queue_full"
+TIMEOUT = "timeout"
+
+
+class ConcurrencyLimiter:
+	"""
+	At most `limit` concurrent holders; up to `queue_size` more wait in arrival order for `timeout` seconds.
+
+	A released slot is handed directly to the oldest waiter, so a burst cannot overtake the queue.
+	"""
+
+	def __init__(self, name: str, limit: int, queue_size: int, timeout: float):
+		self.name = name
+		self.limit = limit
+		self.queue_size = queue_size
+		self.timeout = timeout
+		self.active = 0
+		self._waiters: Deque[asyncio.Future] = deque()
+		admission_in_flight.set_function(lambda: self.active, name)
+		admission_queue_depth.set_function(lambda: len(self._waiters), name)
+
+	async def acquire(self) -> bool:
+		"""Wait for a slot; returns False, after counting the shed request, when none can be had."""
+		if self.active < self.limit and not self._waiters:
+			self.active += 1
+			return True
+		if len(self._waiters) >= self.queue_size:
+			admission_shed.inc(self.name, QUEUE_FULL)
+			return False
+
+		loop = asyncio.get_running_loop()
+		waiter = loop.create_future()
+		self._waiters.append(waiter)
+		timer = loop.call_later(self.timeout, lambda: waiter.done() or waiter.set_result(False))
+		try:
+			admitted = await waiter
+		except asyncio.CancelledError:
+			# The client went away after the slot was handed over: pass it on
+			if waiter.done() and not waiter.cancelled() and waiter.result():
+				self.release()
+			raise
+		finally:
+			timer.cancel()
+			if waiter in self._waiters:
+				self._waiters.remove(waiter)
+		if not admitted:
+			admission_shed.inc(self.name, TIMEOUT)
+		return admitted
+
+	def release(self):
+		while self._waiters:
+			waiter = self._waiters.popleft()
+			if not waiter.done():
+				waiter.set_result(True)
+				return
+		self.active -= 1
+
+
+class AdmissionControlMiddleware:
+	"""
+	Sheds load before it reaches the endpoints.
+
+	Each route in `limits` gets its own ConcurrencyLimiter, every other route shares one of `default_limit`, and
+	`exempt_paths` (a trailing slash makes a prefix) bypass admission control. A request that finds the queue
+	full or waits longer than `queue_timeout` is answered 503 with Retry-After right away.
+	"""
+
+	def __init__(
+			self, app: ASGIApp, limits: Dict[str, int], default_limit: int, exempt_paths: Iterable[str],
+			queue_size: int, queue_timeout: float, retry_after: int,
+	):
+		self.app = app
+		self.limiters = {
+			path: ConcurrencyLimiter(path, limit, queue_size, queue_timeout) for path, limit in limits.items()
+		}
+		self.default_limiter = ConcurrencyLimiter("default", default_limit, queue_size, queue_timeout)
+		self.exempt_paths = {path for path in exempt_paths if not path.endswith("/")}
+		self.exempt_prefixes = tuple(path for path in exempt_paths if path.endswith("/"))
+		self.retry_after = retry_after
+		self._body = json.dumps({"detail": "The server is busy, please retry later."}).encode()
+
+	def _is_exempt(self, scope: Scope) -> bool:
+		path = scope["path"]
+		# CORS preflights never reach an endpoint
+		return scope["method"] == "OPTIONS" or path in self.exempt_paths or path.startswith(self.exempt_prefixes)
+
+	@staticmethod
+	def _resolve_endpoint(scope: Scope):
+		# A shed request never reaches the router: match it here so the metrics label it with its route template
+		for route in getattr(scope.get("app"), "routes", []):
+			match, child_scope = route.matches(scope)
+			if match == Match.FULL:
+				scope["endpoint"] = child_scope.get("endpoint")
+				return
+
+	async def _reject(self, send: Send):
+		await send({
+			"type": "http.response.start",
+			"status": 503,
+			"headers": [
+				(b"content-type", b"application/json"),
+				(b"content-length", str(len(self._body)).encode()),
+				(b"retry-after", str(self.retry_after).encode()),
+			],
+		})
+		await send({"type": "http.response.body", "body": self._body})
+
+	async def __call__(self, scope: Scope, receive: Receive, send: Send):
+		if scope["type"] != "http" or self._is_exempt(scope):
+			await self.app(scope, receive, send)
+			return
+
+		limiter = self.limiters.get(scope["path"], self.default_limiter)
+		if not await limiter.acquire():
+			# Counted in robofast_admission_shed_total; a warning per request would flood the logs during a spike
+			logger.debug("Shedding %s %s: %s is saturated", scope["method"], scope["path"], limiter.name)
+			self._resolve_endpoint(scope)
+			await self._reject(send)
+			return
+		try:
+			await self.app(scope, receive, send)
+		finally:
+			limiter.release()
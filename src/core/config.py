@@ -1,9 +1,10 @@
 import os
-import logging
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
 from pathlib import Path
 
+from src.core.log import configure_logging
 from src.helpers.prompts import assemble_chatgpt_model_description
 
 
@@ -11,13 +12,31 @@ class Settings(BaseSettings):
 	DEBUG: bool = False
 	ENVIRONMENT: str
 	LOG_LEVEL: str = "INFO"
+	LOG_FORMAT: str = "json"  # "json" for one JSON object per line, "text" for the plain format
+	LOG_QUEUE_SIZE: int = 10000  # records waiting for the background writer; further records are dropped
 
 	OPENAPI_TITLE: str = "RoboFast Application"
 	OPENAPI_VERSION: str = "v0.1"
 	OPENAPI_DESCRIPTION: str = "RoboFast Application"
 	BASE_URL: str = "http://testserver"
 	OPENAPI_PATH: str = "openapi.yaml"
+	OPENAPI_JSON_PATH: str = "openapi.json"
+	DOCUMENT_MAX_AGE: int = 300  # seconds clients may cache the manifest and OpenAPI documents
+	WARMUP_TIMEOUT: float = 5  # seconds startup waits for the JWKS, catalog and management token warm-up
+	SNAPSHOT_PATH: Optional[str] = "robofast.snapshot"  # warm-start cache snapshot, empty to disable
+	SNAPSHOT_INTERVAL: int = 300  # seconds between snapshot writes, besides the one at shutdown
 	DOC_PATH: str = "api/docs"
+	# Admission control: concurrent requests per route, with a bounded queue in front of each limit
+	ADMISSION_LIMITS: Dict[str, int] = {
+		"/payment/payment-link": 32, "/payment/customer-portal": 32, "/payment/subscriptions": 64,
+	}
+	ADMISSION_DEFAULT_LIMIT: int = 128  # shared by every other route that is not exempt
+	ADMISSION_EXEMPT_PATHS: List[str] = [
+		"/healthcheck", "/.well-known/ai-plugin.json", "/metrics", "/static/",
+	]  # never limited; a trailing slash matches the whole prefix
+	ADMISSION_QUEUE_SIZE: int = 64  # requests waiting per route once its limit is reached, further ones get a 503
+	ADMISSION_QUEUE_TIMEOUT: float = 5  # seconds a queued request waits for a slot before it gets a 503
+	ADMISSION_RETRY_AFTER: int = 2  # Retry-After seconds of a shed request
 
 	NAME_HUMAN: str = "RoboFast Open Source"
 	NAME_MODEL: str = "RoboFast"
@@ -29,6 +48,7 @@ class Settings(BaseSettings):
 	STATE_SECRET_KEY: str  # For SessionMiddleware
 	ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 	AUTH0_DOMAIN: str
+	AUTH0_BASE_URL: Optional[str] = None  # Defaults to https://{AUTH0_DOMAIN}, override to use a stand-in server
 	AUTH0_CLIENT_ID: str
 	AUTH0_CLIENT_SECRET: str
 	AUTH0_API_IDENTIFIER: str
@@ -36,8 +56,46 @@ class Settings(BaseSettings):
 	AUTH0_MGM_CLIENT_SECRET: str
 	CHATGPT_AUTH_TOKEN: str = None  # The code you get after authenticating your app
 	AUTH_ALGORITHM: str = "RS256"
+	JWKS_CACHE_TTL: int = 3600  # seconds, used when Auth0 sends no Cache-Control max-age
+	JWKS_MIN_REFRESH_INTERVAL: int = 60  # seconds between refetches, also the lower bound for the TTL
+	TOKEN_CACHE_SIZE: int = 10000  # verified bearer tokens kept in memory
+	AUTH0_MGM_TOKEN_RENEW_MARGIN: int = 300  # seconds before expiry the management token is renewed
+	AUTH0_MGM_RATE_LIMIT: float = 2  # Management API requests per second, lowered further by X-RateLimit headers
+	AUTH0_MGM_RATE_BURST: int = 10  # Management API requests let through at once before pacing starts
+	AUTH0_MGM_RATE_MAX_WAIT: float = 10  # seconds a call may queue for the rate limit before it fails with a 503
 	# Stripe
 	STRIPE_SECRET_KEY: str
+	STRIPE_API_BASE: Optional[str] = None  # Defaults to the Stripe SDK's api_base, override to use a stand-in server
+	CATALOG_CACHE_TTL: int = 300  # seconds the product/price catalog is served without revalidation
+	CATALOG_STALE_TTL: int = 3600  # seconds a stale catalog is still served while it is refreshed
+	STRIPE_WEBHOOK_SECRET: Optional[str] = None  # Signing secret of the /payment/webhook endpoint
+	SUBSCRIPTION_SYNC_TTL: int = 60  # seconds gated routes trust synced subscriptions when no webhook keeps them current
+	STRIPE_MAX_WORKERS: int = 8  # threads running blocking Stripe SDK calls
+	STRIPE_CALL_TIMEOUT: int = 20  # seconds, including the time spent waiting for a free worker
+	CUSTOMER_MAPPING_TTL: int = 24 * 3600  # seconds an Auth0 sub to Stripe customer id mapping is trusted
+	CUSTOMER_MAPPING_CACHE_SIZE: int = 10000  # mappings also kept in memory
+	CIRCUIT_FAILURE_THRESHOLD: int = 5  # consecutive upstream failures that open its circuit breaker
+	CIRCUIT_RECOVERY_TIMEOUT: int = 30  # seconds an open circuit fails fast before a probe call is let through
+	CHECKOUT_REUSE_WINDOW: int = 600  # seconds an open checkout session is reused for the same user and price
+	CHECKOUT_SESSION_CACHE_SIZE: int = 10000  # open checkout sessions kept in memory
+	PORTAL_SESSION_REUSE_WINDOW: int = 240  # seconds a customer portal link is reused, below Stripe's 5 minute expiry
+	PORTAL_SESSION_CACHE_SIZE: int = 10000  # customer portal links kept in memory
+	# Local state
+	LOCAL_STORE_PATH: str = "robofast.sqlite3"
+	AUTH0_OUTBOX_BATCH_SIZE: int = 50  # queued app_metadata updates sent to Auth0 per outbox pass
+	AUTH0_OUTBOX_CONCURRENCY: int = 4  # app_metadata updates in flight at once
+	AUTH0_OUTBOX_POLL_INTERVAL: int = 5  # seconds between outbox passes when no new update wakes the worker
+	AUTH0_OUTBOX_MAX_BACKOFF: int = 3600  # longest delay before a failed app_metadata update is retried
+	AUTH0_OUTBOX_SHUTDOWN_TIMEOUT: int = 5  # seconds shutdown spends delivering queued updates, the rest waits
+	USER_IMPORT_INTERVAL: int = 0  # seconds between imports of every user's Stripe id from Auth0, 0 disables them
+	USER_IMPORT_BATCH_SIZE: int = 500  # imported mappings written to the local store per transaction
+	# Subscription quotas
+	QUOTA_WINDOW_SECONDS: int = 30 * 24 * 3600  # sliding window the per-tier request limit applies to
+	QUOTA_SHARED_STORE: bool = False  # share quota counters between worker processes through LOCAL_STORE_PATH
+
+	@property
+	def auth0_base_url(self) -> str:
+		return (self.AUTH0_BASE_URL or f"https://{self.AUTH0_DOMAIN}").rstrip("/")
 
 	class Config:
 		env_prefix = "APP_"  # values from environment will be read with this prefix
@@ -52,12 +110,5 @@ load_dotenv(env_path)
 
 settings = Settings()
 
-# Configure the logger
-logging.basicConfig(
-	level=settings.LOG_LEVEL,
-	format="%(asctime)s - %(levelname)s - %(message)s",
-	handlers=[
-		logging.StreamHandler()
-	]
-)
-logger = logging.getLogger()
+# Log records are written by a background thread, never on the event loop
+logger = configure_logging(settings.LOG_LEVEL, settings.LOG_FORMAT, settings.LOG_QUEUE_SIZE)
@@ -1,8 +1,12 @@
+import math
 import jwt
+import httpx
 from typing import Dict, Any
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security.oauth2 import OAuth2PasswordBearer
 from src.core.config import logger, settings
+from src.helpers.circuit import CircuitOpenError
+from src.helpers.jwks import jwks_cache
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -10,12 +14,12 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 security = HTTPBearer()
 
 
-def decode_jwt_token(token: str, auth_domain: str, audience: str) -> Dict[str, Any]:
-	jwks_url = f'https://{auth_domain}/.well-known/jwks.json'
-	jwks_client = jwt.PyJWKClient(jwks_url)
+async def decode_jwt_token(token: str, audience: str) -> Dict[str, Any]:
 	header = jwt.get_unverified_header(token)
-	key = jwks_client.get_signing_key(header["kid"]).key
-	decoded = jwt.decode(token, key, [header["alg"]], audience=audience)
+	signing_key = await jwks_cache.get_signing_key(header.get("kid"))
+	if signing_key is None:
+		raise jwt.PyJWKClientError(f"Unable to find a signing key that matches: {header.get('kid')}")
+	decoded = jwt.decode(token, signing_key.pyjwt_key, [header["alg"]], audience=audience)
 	return decoded
 
 
@@ -25,12 +29,22 @@ async def get_current_user(authorization: str) -> Dict[str, Any]:
 
 	access_token = authorization[7:]
 	try:
-		decoded_token = decode_jwt_token(
+		decoded_token = await decode_jwt_token(
 			token=access_token,
-			auth_domain=settings.AUTH0_DOMAIN,
 			audience=settings.AUTH0_API_IDENTIFIER
 		)
 	except jwt.PyJWTError as e:
 		raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Invalid token: {str(e)}")
+	except httpx.HTTPError as e:
+		raise HTTPException(
+			status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+			detail=f"Authentication service not available: {str(e)}"
+		)
+	except CircuitOpenError as e:
+		raise HTTPException(
+			status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+			detail=f"Authentication service not available: {str(e)}",
+			headers={"Retry-After": str(math.ceil(e.retry_after))},
+		)
 
 	return decoded_token
@@ -0,0 +1,189 @@
+import atexit
+import json
+import logging
+import queue
+import re
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+REDACTED = "[REDACTED]"
+# `extra` fields whose value is never written out
+SECRET_FIELDS = {
+	"authorization", "access_token", "refresh_token", "id_token", "token", "client_secret", "password",
+	"secret", "api_key", "stripe_signature", "stripe-signature", "cookie",
+}
+SECRET_PATTERNS = [
+	# Authorization header values
+	(re.compile(r"(?i)\b(bearer|basic)\s+[A-Za-z0-9\-._~+/]+=*"), r"\1 " + REDACTED),
+	# JWTs anywhere in a message
+	(re.compile(r"\beyJ[A-Za-z0-9_-]*\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*"), REDACTED),
+	# Stripe secret, restricted and webhook signing keys
+	(re.compile(r"\b(sk|rk|whsec)_(live|test)?_?[A-Za-z0-9]+"), r"\1_" + REDACTED),
+	# Stripe-Signature header values: t=...,v1=...
+	(re.compile(r"\b(v0|v1)=[0-9a-f]+"), r"\1=" + REDACTED),
+]
+# Attributes every LogRecord has; anything else was passed through `extra`
+RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "request_id"}
+# Uvicorn's ANSI-colored copy of the message
+RECORD_ATTRIBUTES.add("color_message")
+
+
+def redact(text: str) -> str:
+	for pattern, replacement in SECRET_PATTERNS:
+		text = pattern.sub(replacement, text)
+	return text
+
+
+def redact_value(value: Any) -> Any:
+	"""Redact an `extra` value: secret keys at any depth of dicts and lists, secret patterns in strings."""
+	if isinstance(value, str):
+		return redact(value)
+	if isinstance(value, dict):
+		return {
+			key: REDACTED if str(key).lower() in SECRET_FIELDS else redact_value(item) for key, item in value.items()
+		}
+	if isinstance(value, (list, tuple, set)):
+		return [redact_value(item) for item in value]
+	return value
+
+
+class RedactingFormatter(logging.Formatter):
+	"""The usual text format, with tokens and keys masked."""
+
+	def format(self, record: logging.LogRecord) -> str:
+		return redact(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+	"""One JSON object per line: time, level, logger, request id, message and any `extra` fields."""
+
+	def format(self, record: logging.LogRecord) -> str:
+		entry = {
+			"time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+			"level": record.levelname,
+			"logger": record.name,
+			"request_id": getattr(record, "request_id", "-"),
+			"message": redact(record.getMessage()),
+		}
+		for key, value in record.__dict__.items():
+			if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+				entry[key] = REDACTED if key.lower() in SECRET_FIELDS else redact_value(value)
+		if record.exc_info:
+			entry["exception"] = redact(self.formatException(record.exc_info))
+		return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+	"""
+	Hands records to the background writer without formatting them on the calling thread.
+
+	The message is only rendered by the writer, so arguments must not be mutated after the logging call.
+	When the queue is full the record is dropped rather than blocking the event loop.
+	"""
+
+	def __init__(self, log_queue: queue.Queue):
+		super().__init__(log_queue)
+		self.dropped = 0
+
+	def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+		record.request_id = request_id_var.get()
+		return record
+
+	def enqueue(self, record: logging.LogRecord):
+		try:
+			self.queue.put_nowait(record)
+		except queue.Full:
+			self.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+# Configured by uvicorn with their own synchronous handlers, and propagate=False
+SERVER_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+
+def configure_logging(level: str = "INFO", log_format: str = "json", queue_size: int = 10000) -> logging.Logger:
+	"""
+	Route the root logger through a bounded queue to a StreamHandler running on a background thread.
+
+	The server's loggers are handed over to the root logger too. Uvicorn sets them up before it imports the
+	application, so this runs afterwards.
+	"""
+	global _listener
+	stop_logging()
+
+	stream_handler = logging.StreamHandler()
+	if log_format == "json":
+		stream_handler.setFormatter(JsonFormatter())
+	else:
+		stream_handler.setFormatter(
+			RedactingFormatter("%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s", defaults={"request_id": "-"})
+		)
+
+	log_queue = queue.Queue(maxsize=queue_size)
+	root = logging.getLogger()
+	for handler in list(root.handlers):
+		root.removeHandler(handler)
+	root.addHandler(NonBlockingQueueHandler(log_queue))
+	root.setLevel(level)
+	for name in SERVER_LOGGERS:
+		server_logger = logging.getLogger(name)
+		for handler in list(server_logger.handlers):
+			server_logger.removeHandler(handler)
+		server_logger.propagate = True
+
+	_listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+	_listener.start()
+	return root
+
+
+def stop_logging():
+	"""Flush the queued records and stop the writer thread."""
+	global _listener
+	if _listener is not None:
+		_listener.stop()
+		_listener = None
+
+
+atexit.register(stop_logging)
+
+
+class RequestIdMiddleware:
+	"""
+	Tags every log record written while handling a request with its id.
+
+	The id is taken from the X-Request-ID header when the proxy sets one, generated otherwise, and
+	returned in the X-Request-ID response header.
+	"""
+
+	header = b"x-request-id"
+
+	def __init__(self, app: ASGIApp):
+		self.app = app
+
+	async def __call__(self, scope: Scope, receive: Receive, send: Send):
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+
+		request_id = next((value.decode("latin-1") for name, value in scope["headers"] if name == self.header), None)
+		if not request_id or len(request_id) > 128:
+			request_id = uuid.uuid4().hex
+		token = request_id_var.set(request_id)
+
+		async def send_with_request_id(message: Message):
+			if message["type"] == "http.response.start":
+				message.setdefault("headers", [])
+				message["headers"] = list(message["headers"]) + [(self.header, request_id.encode("latin-1"))]
+			await send(message)
+
+		try:
+			await self.app(scope, receive, send_with_request_id)
+		finally:
+			request_id_var.reset(token)
@@ -0,0 +1,230 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Seconds; covers cached responses (~ms) up to slow upstream calls with retries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+	return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+	pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+	if extra:
+		pairs.append(extra)
+	return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+	return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+	"""Monotonic counter per label combination."""
+
+	type = "counter"
+
+	def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+		self.name = name
+		self.documentation = documentation
+		self.labels = labels
+		self._values: Dict[LabelValues, float] = {}
+		self._lock = threading.Lock()
+
+	def inc(self, *label_values: str, amount: float = 1):
+		with self._lock:
+			self._values[label_values] = self._values.get(label_values, 0) + amount
+
+	def value(self, *label_values: str) -> float:
+		return self._values.get(label_values, 0)
+
+	def samples(self) -> List[str]:
+		with self._lock:
+			values = list(self._values.items())
+		return [f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}" for labels, value in values]
+
+
+class Gauge:
+	"""Value read from a callback at scrape time, e.g. a queue depth or cache size."""
+
+	type = "gauge"
+
+	def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+		self.name = name
+		self.documentation = documentation
+		self.labels = labels
+		self._callbacks: Dict[LabelValues, Callable[[], float]] = {}
+
+	def set_function(self, func: Callable[[], float], *label_values: str):
+		self._callbacks[label_values] = func
+
+	def samples(self) -> List[str]:
+		return [
+			f"{self.name}{_format_labels(self.labels, labels)} {_format_value(func())}"
+			for labels, func in list(self._callbacks.items())
+		]
+
+
+class Histogram:
+	"""
+	Fixed-bucket histogram per label combination.
+
+	An observation increments a single bucket; the cumulative counts Prometheus expects are only
+	computed when the metrics are rendered.
+	"""
+
+	type = "histogram"
+
+	def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+		self.name = name
+		self.documentation = documentation
+		self.labels = labels
+		self.buckets = tuple(buckets)
+		# label values -> [count per bucket (last one is +Inf)..., sum]
+		self._values: Dict[LabelValues, List[float]] = {}
+		self._lock = threading.Lock()
+
+	def observe(self, value: float, *label_values: str):
+		index = bisect_left(self.buckets, value)
+		with self._lock:
+			series = self._values.get(label_values)
+			if series is None:
+				series = self._values[label_values] = [0] * (len(self.buckets) + 2)
+			series[index] += 1
+			series[-1] += value
+
+	def count(self, *label_values: str) -> int:
+		series = self._values.get(label_values)
+		return int(sum(series[:-1])) if series else 0
+
+	def samples(self) -> List[str]:
+		with self._lock:
+			values = [(labels, list(series)) for labels, series in self._values.items()]
+		lines = []
+		for labels, series in values:
+			cumulative = 0
+			for bound, bucket_count in zip(self.buckets + (float("inf"),), series[:-1]):
+				cumulative += bucket_count
+				le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+				lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+			lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(series[-1])}")
+			lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+		return lines
+
+
+class MetricsRegistry:
+	"""In-process metrics, rendered in the Prometheus text exposition format."""
+
+	def __init__(self):
+		self._metrics: Dict[str, object] = {}
+
+	def _register(self, metric):
+		if metric.name in self._metrics:
+			raise ValueError(f"Metric {metric.name} is already registered")
+		self._metrics[metric.name] = metric
+		return metric
+
+	def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+		return self._register(Counter(name, documentation, labels))
+
+	def gauge(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Gauge:
+		return self._register(Gauge(name, documentation, labels))
+
+	def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+		return self._register(Histogram(name, documentation, labels, buckets))
+
+	def render(self) -> str:
+		lines = []
+		for metric in self._metrics.values():
+			lines.append(f"# HELP {metric.name} {metric.documentation}")
+			lines.append(f"# TYPE {metric.name} {metric.type}")
+			lines.extend(metric.samples())
+		return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+http_requests = metrics.counter(
+	"robofast_http_requests_total", "HTTP requests handled, by route template and status code.",
+	("method", "route", "status"),
+)
+http_request_duration = metrics.histogram(
+	"robofast_http_request_duration_seconds", "Time to answer an HTTP request, by route template.",
+	("method", "route"),
+)
+upstream_requests = metrics.counter(
+	"robofast_upstream_requests_total", "Calls made to Auth0 and Stripe, by outcome.",
+	("upstream", "operation", "outcome"),
+)
+upstream_request_duration = metrics.histogram(
+	"robofast_upstream_request_duration_seconds", "Duration of a single call to Auth0 or Stripe.",
+	("upstream", "operation"),
+)
+upstream_retries = metrics.counter(
+	"robofast_upstream_retries_total", "Calls to Auth0 or Stripe that were retried.",
+	("upstream", "operation"),
+)
+upstream_timeouts = metrics.counter(
+	"robofast_upstream_timeouts_total", "Calls to Stripe abandoned after the executor timeout (queue wait included).",
+	("upstream", "operation"),
+)
+
+
+def observe_upstream(upstream: str, operation: str, started: float, outcome: str = "ok"):
+	"""Record one upstream call that began at `started` (a time.perf_counter() value)."""
+	upstream_request_duration.observe(time.perf_counter() - started, upstream, operation)
+	upstream_requests.inc(upstream, operation, outcome)
+
+
+class MetricsMiddleware:
+	"""
+	Records the latency and status code of every HTTP request.
+
+	Requests are labelled with the path template of the route that handled them ("/payment/payment-link",
+	"/static/{path}"), and requests no route matched share the "unmatched" label, so the number of series
+	stays bounded whatever paths clients send.
+	"""
+
+	def __init__(self, app: ASGIApp):
+		self.app = app
+		self._route_templates: Optional[Dict[object, str]] = None
+
+	def _route_template(self, scope: Scope) -> str:
+		if self._route_templates is None:
+			templates = {}
+			for route in getattr(scope.get("app"), "routes", []):
+				if hasattr(route, "endpoint"):
+					templates[route.endpoint] = route.path
+				elif hasattr(route, "app"):
+					templates[route.app] = f"{route.path}/{{path}}"
+			self._route_templates = templates
+		# The router stores the matched endpoint in the (shared) scope
+		return self._route_templates.get(scope.get("endpoint"), "unmatched")
+
+	async def __call__(self, scope: Scope, receive: Receive, send: Send):
+		if scope["type"] != "http":
+			await self.app(scope, receive, send)
+			return
+
+		status = 500
+		started = time.perf_counter()
+
+		async def send_with_status(message: Message):
+			nonlocal status
+			if message["type"] == "http.response.start":
+				status = message["status"]
+			await send(message)
+
+		try:
+			await self.app(scope, receive, send_with_status)
+		finally:
+			route = self._route_template(scope)
+			http_request_duration.observe(time.perf_counter() - started, scope["method"], route)
+			http_requests.inc(scope["method"], route, str(status))
@@ -1,8 +1,12 @@
+import json
+from typing import Tuple
+
+import yaml
 from fastapi import FastAPI
 from fastapi.openapi.utils import get_openapi
-from src.core.config import Settings
-
-settings = Settings()
+from src.core.config import settings
+from src.core.responses import PrecomputedResponse
+from src.core.static import static_assets
 
 
 def chatgpt_openapi(app: FastAPI) -> dict:
@@ -15,7 +19,7 @@ def chatgpt_openapi(app: FastAPI) -> dict:
 		routes=app.routes,
 	)
 	openapi_schema["info"]["x-logo"] = {
-		"url": "/static/images/logo.png"
+		"url": static_assets.url("images/logo.png")
 	}
 	# Add server url
 	openapi_schema["servers"] = [
@@ -26,3 +30,21 @@ def chatgpt_openapi(app: FastAPI) -> dict:
 	]
 	app.openapi_schema = openapi_schema
 	return app.openapi_schema
+
+
+def build_openapi_documents(app: FastAPI) -> Tuple[PrecomputedResponse, PrecomputedResponse]:
+	"""
+	Encode the OpenAPI schema once, as JSON and as YAML.
+	"""
+	openapi_schema = chatgpt_openapi(app)
+	cache_control = f"public, max-age={settings.DOCUMENT_MAX_AGE}"
+	json_document = PrecomputedResponse(
+		json.dumps(openapi_schema, separators=(",", ":")).encode(),
+		cache_control=cache_control,
+	)
+	yaml_document = PrecomputedResponse(
+		yaml.safe_dump(openapi_schema, sort_keys=False, allow_unicode=True).encode(),
+		media_type="application/yaml",
+		cache_control=cache_control,
+	)
+	return json_document, yaml_document
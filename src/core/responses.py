@@ -0,0 +1,99 @@
+import gzip
+import hashlib
+from typing import Dict, Optional, Set
+
+import brotli
+from fastapi import Request, Response
+
+# Bodies smaller than this are not worth the Content-Encoding
+COMPRESS_MIN_SIZE = 512  # bytes
+# A variant must save at least this fraction of the body to be kept; images are already compressed
+COMPRESS_MIN_SAVING = 0.1
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+	if not if_none_match:
+		return False
+	if if_none_match.strip() == "*":
+		return True
+	# Weak comparison, as required for If-None-Match
+	candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+	return etag in candidates
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> Set[str]:
+	"""The content codings of an Accept-Encoding header with a non-zero quality."""
+	encodings = set()
+	for item in (accept_encoding or "").split(","):
+		coding, _, parameters = item.partition(";")
+		quality = parameters.strip().removeprefix("q=")
+		try:
+			if parameters and float(quality) == 0:
+				continue
+		except ValueError:
+			continue
+		if coding.strip():
+			encodings.add(coding.strip().lower())
+	return encodings
+
+
+def compress_variants(body: bytes) -> Dict[str, bytes]:
+	"""Build the brotli and gzip encodings of `body` that are smaller enough to be worth serving."""
+	if len(body) < COMPRESS_MIN_SIZE:
+		return {}
+	variants = {
+		"br": brotli.compress(body, quality=11),
+		# mtime=0 keeps the output, and so the ETag, stable across restarts
+		"gzip": gzip.compress(body, compresslevel=9, mtime=0),
+	}
+	return {
+		encoding: data for encoding, data in variants.items()
+		if len(data) <= len(body) * (1 - COMPRESS_MIN_SAVING)
+	}
+
+
+class PrecomputedResponse:
+	"""
+	An encoded response body built once, served with a strong ETag and answered with 304 when unchanged.
+
+	The brotli and gzip encodings are also built once and picked from Accept-Encoding;
+	each encoding gets its own ETag.
+	"""
+
+	# Preferred first
+	ENCODINGS = ("br", "gzip")
+
+	def __init__(
+			self, body: bytes, media_type: str = "application/json", cache_control: str = "no-cache",
+			compress: bool = True,
+	):
+		self.body = body
+		self.media_type = media_type
+		self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+		self.headers = {"ETag": self.etag, "Cache-Control": cache_control}
+		self.variants = compress_variants(body) if compress else {}
+		if self.variants:
+			self.headers["Vary"] = "Accept-Encoding"
+		self._variant_headers = {
+			encoding: {**self.headers, "ETag": f'"{self.etag[1:-1]}-{encoding}"', "Content-Encoding": encoding}
+			for encoding in self.variants
+		}
+
+	def _select(self, request: Request) -> Optional[str]:
+		if not self.variants:
+			return None
+		accepted = accepted_encodings(request.headers.get("accept-encoding"))
+		for encoding in self.ENCODINGS:
+			if encoding in self.variants and encoding in accepted:
+				return encoding
+		return None
+
+	def to_response(self, request: Request) -> Response:
+		encoding = self._select(request)
+		headers = self._variant_headers[encoding] if encoding else self.headers
+		if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+			# A 304 carries no Content-Encoding
+			return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Content-Encoding"})
+		body = self.variants[encoding] if encoding else self.body
+		return Response(content=body, media_type=self.media_type, headers=headers)
@@ -29,6 +29,14 @@ class SubscriptionsResponse(BaseModel):
 	hint: Optional[str] = Field(default="You don't need to output product_id and price_id in your frontend.")
 
 
+class SubscriptionUsageResponse(BaseModel):
+	product_id: str
+	subscription: str
+	request_limit: Optional[int]  # None means unlimited
+	requests_remaining: Optional[int]
+	hint: str = Field(default="Requests beyond the limit are refused until older ones leave the quota window.")
+
+
 class LinkResponse(BaseModel):
 	url: str
 	hint: str = Field(
@@ -0,0 +1,43 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+# Deliberately free of project imports so it can time the import of everything else
+logger = logging.getLogger()
+
+
+class StartupReport:
+	"""Wall-clock cost of every import, initialization and warm-up step of the application startup."""
+
+	def __init__(self):
+		self.entries: List[Dict[str, object]] = []
+		self.started = time.perf_counter()
+
+	def record(self, phase: str, component: str, seconds: float, status: str = "ok"):
+		self.entries.append({"phase": phase, "component": component, "ms": round(seconds * 1000, 1), "status": status})
+
+	@contextmanager
+	def measure(self, phase: str, component: str) -> Iterator[None]:
+		started = time.perf_counter()
+		status = "ok"
+		try:
+			yield
+		except BaseException as e:
+			status = f"failed: {type(e).__name__}"
+			raise
+		finally:
+			self.record(phase, component, time.perf_counter() - started, status)
+
+	def as_dict(self) -> Dict[str, object]:
+		return {"total_ms": round((time.perf_counter() - self.started) * 1000, 1), "steps": self.entries}
+
+	def log(self):
+		lines = [f"  {entry['phase']:<8} {entry['component']:<28} {entry['ms']:>9.1f} ms  {entry['status']}" for entry in self.entries]
+		total_ms = (time.perf_counter() - self.started) * 1000
+		logger.info(
+			"Startup report (%.1f ms since first import):\n%s", total_ms, "\n".join(lines), extra={"startup": self.entries}
+		)
+
+
+startup_report = StartupReport()
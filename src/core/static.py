@@ -0,0 +1,86 @@
+import hashlib
+import mimetypes
+import os
+from typing import Dict
+
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.types import Receive, Scope, Send
+
+from src.core.config import settings, logger
+from src.core.responses import IMMUTABLE, PrecomputedResponse
+
+
+def hashed_name(path: str, digest: str) -> str:
+	"""images/logo.png -> images/logo.<digest>.png"""
+	root, extension = os.path.splitext(path)
+	return f"{root}.{digest}{extension}"
+
+
+class StaticAssets:
+	"""
+	Serves the files of `directory` from memory, read and compressed once by `load`.
+
+	The application lifespan loads them at startup; until then the first use does. Every file is also
+	reachable under a content-hashed name (see `url`). That URL changes whenever the file does, so it is
+	served as immutable; the plain name stays revalidated after `max_age` seconds.
+	"""
+
+	def __init__(self, directory: str, prefix: str = "/static", max_age: int = 300):
+		self.directory = directory
+		self.prefix = prefix
+		self.max_age = max_age
+		self.responses: Dict[str, PrecomputedResponse] = {}
+		self.hashed_names: Dict[str, str] = {}
+		self.loaded = False
+
+	def load(self):
+		if self.loaded:
+			return
+		max_age = self.max_age
+		for root, _, files in os.walk(self.directory):
+			for file in files:
+				file_path = os.path.join(root, file)
+				path = os.path.relpath(file_path, self.directory).replace(os.sep, "/")
+				with open(file_path, "rb") as f:
+					body = f.read()
+				media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+				digest = hashlib.sha256(body).hexdigest()[:12]
+				self.hashed_names[path] = hashed_name(path, digest)
+				self.responses[path] = PrecomputedResponse(
+					body, media_type=media_type, cache_control=f"public, max-age={max_age}"
+				)
+				self.responses[self.hashed_names[path]] = PrecomputedResponse(
+					body, media_type=media_type, cache_control=IMMUTABLE
+				)
+		self.loaded = True
+		logger.info("Loaded %d static assets from %s", len(self.hashed_names), self.directory)
+
+	def url(self, path: str) -> str:
+		"""The content-hashed URL of a static file, e.g. /static/images/logo.<digest>.png"""
+		self.load()
+		return f"{self.prefix}/{self.hashed_names[path]}"
+
+	@staticmethod
+	def _relative_path(scope: Scope) -> str:
+		# Depending on the Starlette version, a mounted app sees its path with or without the mount prefix
+		path, root_path = scope["path"], scope.get("root_path", "")
+		if root_path and path.startswith(root_path + "/"):
+			path = path[len(root_path):]
+		return path.lstrip("/")
+
+	async def __call__(self, scope: Scope, receive: Receive, send: Send):
+		request = Request(scope, receive)
+		if request.method not in ("GET", "HEAD"):
+			response = PlainTextResponse("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+		else:
+			self.load()
+			precomputed = self.responses.get(self._relative_path(scope))
+			if precomputed is None:
+				response = PlainTextResponse("Not Found", status_code=404)
+			else:
+				response = precomputed.to_response(request)
+		await response(scope, receive, send)
+
+
+static_assets = StaticAssets("static", max_age=settings.DOCUMENT_MAX_AGE)
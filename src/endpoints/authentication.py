@@ -1,10 +1,33 @@
-from typing import Any, Dict
+from typing import Any, Dict, Optional
+import hashlib
+import time
 import httpx
 from src.core.config import settings
+from src.helpers.cache import TTLCache
+from src.helpers.circuit import CircuitOpenError
+from src.helpers.jwks import jwks_cache
+from src.helpers.store import subscription_store
 from fastapi import Request, HTTPException, Query, status, Response
 from fastapi.responses import RedirectResponse
 from urllib.parse import urlencode
-from jose import jwk, jwt
+from jose import jwt
+
+# Validated claims keyed by the SHA-256 of the bearer token, each entry expires with the token
+token_cache = TTLCache(maxsize=settings.TOKEN_CACHE_SIZE, name="access_tokens")
+
+
+def _token_cache_key(access_token: str) -> str:
+	return hashlib.sha256(access_token.encode()).hexdigest()
+
+
+def invalidate_token_cache(access_token: Optional[str] = None):
+	"""
+	Drop the cached claims of a single token, or of every token when none is given.
+	"""
+	if access_token is None:
+		token_cache.clear()
+	else:
+		token_cache.pop(_token_cache_key(access_token))
 
 
 def get_chatgpt_headers(request: Request):
@@ -14,10 +37,15 @@ def get_chatgpt_headers(request: Request):
 
 async def decode_access_token(access_token: str):
 	try:
-		async with httpx.AsyncClient() as client:
-			resp = await client.get(f"https://{settings.AUTH0_DOMAIN}/.well-known/jwks.json")
-			resp.raise_for_status()
-			jwks = resp.json()
+		header = jwt.get_unverified_header(access_token)
+	except jwt.JWTError as exc:
+		raise HTTPException(
+			status_code=status.HTTP_400_BAD_REQUEST,
+			detail=f"Failed to decode token header: {str(exc)}"
+		)
+
+	try:
+		signing_key = await jwks_cache.get_signing_key(header.get("kid"))
 	except httpx.RequestError as exc:
 		# Connection error
 		raise HTTPException(
@@ -31,40 +59,16 @@ async def decode_access_token(access_token: str):
 			detail=f"Bad response from authentication service: {str(exc)}"
 		)
 
-	try:
-		header = jwt.get_unverified_header(access_token)
-	except jwt.JWTError as exc:
-		raise HTTPException(
-			status_code=status.HTTP_400_BAD_REQUEST,
-			detail=f"Failed to decode token header: {str(exc)}"
-		)
-
-	rsa_key = {}
-	for key in jwks.get("keys", []):
-		if key.get("kid") == header.get("kid"):
-			rsa_key = {
-				"kty": key.get("kty"),
-				"kid": key.get("kid"),
-				"use": key.get("use"),
-				"alg": key.get("alg"),
-				"n": key.get("n"),
-				"e": key.get("e"),
-			}
-			break
-
-	if not rsa_key:
+	if signing_key is None:
 		raise HTTPException(
 			status_code=status.HTTP_400_BAD_REQUEST,
 			detail="Could not find the appropriate key to decode the token."
 		)
 
-	key = jwk.construct(rsa_key)
-	pem_key = key.to_pem().decode('utf-8')
-
 	try:
 		payload = jwt.decode(
 			access_token,
-			pem_key,
+			signing_key.jose_key,
 			algorithms=["RS256"],
 			audience=settings.AUTH0_API_IDENTIFIER,
 			issuer=f"https://{settings.AUTH0_DOMAIN}/",
@@ -86,10 +90,20 @@ async def get_token_data(authorization: str) -> Dict[str, Any]:
 		raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing or invalid Authorization header")
 
 	access_token = authorization[7:]
+	cache_key = _token_cache_key(access_token)
+	cached_payload = token_cache.get(cache_key)
+	if cached_payload is not None:
+		return dict(cached_payload)
 
 	try:
-		decoded_payload = await decode_access_token(access_token)  # Add await here
-		return decoded_payload
+		decoded_payload = await decode_access_token(access_token)
+		expires_at = decoded_payload.get("exp")
+		if isinstance(expires_at, (int, float)):
+			token_cache.set(cache_key, decoded_payload, ttl=expires_at - time.time())
+		return dict(decoded_payload)
+	except CircuitOpenError:
+		# Answered with 503 by the application's exception handler
+		raise
 	except HTTPException as exc:
 		# Re-raise the HTTPException from decode_access_token
 		raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing or invalid Authorization header")
@@ -100,7 +114,10 @@ async def get_token_data(authorization: str) -> Dict[str, Any]:
 
 def get_user_status(decoded_payload: Dict[str, Any]) -> str:
 	"""
-	Dummy function to get user status. Replace with your actual logic.
+	Return "active" when the local subscription store holds an active subscription for the token's subject.
 	"""
-	# For demonstration, we assume the user is "active" if the 'sub' field exists
-	return "active" if decoded_payload.get("sub") else "inactive"
+	user_id = decoded_payload.get("sub")
+	customer_id = subscription_store.get_customer_id(user_id) if user_id else None
+	if customer_id and subscription_store.get_active_subscription(customer_id) is not None:
+		return "active"
+	return "inactive"
@@ -1,43 +1,150 @@
-from typing import Optional, Dict
-from fastapi import Request, HTTPException, Depends, status
+from typing import Any, Optional, Dict
+import stripe
+from fastapi import Request, Response, HTTPException, Depends, Header, status
 from fastapi.templating import Jinja2Templates
-from stripe.error import InvalidRequestError as StripeInvalidRequestError
+from stripe.error import InvalidRequestError as StripeInvalidRequestError, SignatureVerificationError
 from src.core.config import settings, logger
 from src.endpoints.authentication import get_token_data
-from src.helpers.payment import StripeWithAuth0, StripeProductPriceFetcher
-from src.core.schema import SubscriptionsResponse, CreatePaymentLinkRequest, LinkResponse
-from src.endpoints.plugin import get_headers_dict
+from src.helpers.payment import StripeWithAuth0, is_stripe_failure
+from src.helpers.circuit import CircuitOpenError
+from src.helpers.ratelimit import RateLimitExceeded
+from src.helpers.executor import UpstreamTimeout
+from src.helpers.catalog import catalog_cache
+from src.helpers.webhooks import handle_stripe_event
+from src.helpers.quota import quota_limiter, resolve_subscription_tier
+from src.helpers.store import subscription_store
+from src.core.responses import PrecomputedResponse
+from src.core.schema import CreatePaymentLinkRequest, LinkResponse, SubscriptionUsageResponse
+from src.endpoints.plugin import get_headers_dict, render_page
 
 payment_templates = Jinja2Templates(directory="src/templates/payment")
 
-stripe_with_auth0 = StripeWithAuth0()
 
+def build_payment_documents() -> Dict[str, PrecomputedResponse]:
+	"""Render the checkout result pages. Run by the lifespan."""
+	return {
+		"checkout_success": render_page(payment_templates, "success.html"),
+		"checkout_failure": render_page(payment_templates, "failure.html"),
+	}
 
-async def get_available_subscriptions_func() -> SubscriptionsResponse:
-	fetcher = StripeProductPriceFetcher(api_key=settings.STRIPE_SECRET_KEY)
 
-	logger.info("Fetch product info from Stripe")
-	subscriptions = fetcher.fetch_products_and_prices()
+def get_stripe_with_auth0(request: Request) -> StripeWithAuth0:
+	# Created by the application lifespan, see src/app/lifespan.py
+	return request.app.state.stripe_with_auth0
 
-	if not subscriptions:
+
+async def require_subscription_quota(
+		request: Request,
+		response: Response,
+		headers: Optional[Dict] = Depends(get_headers_dict),
+		stripe_with_auth0: StripeWithAuth0 = Depends(get_stripe_with_auth0),
+) -> Dict[str, Any]:
+	"""
+	Dependency for subscriber-only routes: resolves the caller's tier from the local subscription state and
+	enforces the tier's request limit. Returns the decoded token; the tier and the quota decision are left on
+	request.state.
+	"""
+	authorization = headers.get('authorization')
+	if authorization is None:
+		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Authorization header not found.")
+
+	token_data = await get_token_data(authorization)
+	user_id = token_data.get('sub')
+
+	# Read-only: a gated route must not create Stripe customers
+	customer_id = stripe_with_auth0.known_customer_id(user_id)
+	if customer_id is None:
+		raise HTTPException(status_code=status.HTTP_402_PAYMENT_REQUIRED, detail="An active subscription is required.")
+
+	# Without the webhook nothing updates the store after a sync, so it is only trusted for a while
+	max_age = None if settings.STRIPE_WEBHOOK_SECRET else settings.SUBSCRIPTION_SYNC_TTL
+	if not subscription_store.is_synced(customer_id, max_age=max_age):
+		try:
+			await stripe_with_auth0.sync_subscriptions(customer_id)
+		except UpstreamTimeout as e:
+			raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+		except CircuitOpenError:
+			# Stripe is down: a stale copy beats refusing every subscriber
+			if not subscription_store.is_synced(customer_id):
+				raise
+		except Exception as e:
+			if is_stripe_failure(e):
+				raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Stripe is unavailable.")
+			# e.g. the customer was deleted on Stripe
+			logger.warning("Could not sync the subscriptions of %s: %s", customer_id, e)
+			raise HTTPException(
+				status_code=status.HTTP_402_PAYMENT_REQUIRED, detail="An active subscription is required."
+			)
+
+	tier = await resolve_subscription_tier(user_id)
+	if tier is None:
+		raise HTTPException(status_code=status.HTTP_402_PAYMENT_REQUIRED, detail="An active subscription is required.")
+
+	request.state.subscription_tier = tier
+	request.state.quota_decision = None
+	if tier.request_limit is not None:
+		decision = request.state.quota_decision = quota_limiter.hit(user_id, tier.request_limit)
+		rate_limit_headers = {
+			"X-RateLimit-Limit": str(decision.limit),
+			"X-RateLimit-Remaining": str(decision.remaining),
+		}
+		if not decision.allowed:
+			raise HTTPException(
+				status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+				detail=f"The {tier.name} subscription allows {tier.request_limit} requests per period.",
+				headers={**rate_limit_headers, "Retry-After": str(decision.retry_after)},
+			)
+		response.headers.update(rate_limit_headers)
+
+	return token_data
+
+
+async def get_subscription_usage_func(
+		request: Request, token_data: Dict[str, Any] = Depends(require_subscription_quota),
+) -> SubscriptionUsageResponse:
+	tier = request.state.subscription_tier
+	decision = request.state.quota_decision
+	return SubscriptionUsageResponse(
+		product_id=tier.product_id,
+		subscription=tier.name,
+		request_limit=tier.request_limit,
+		requests_remaining=decision.remaining if decision else None,
+	)
+
+
+async def get_available_subscriptions_func(request: Request) -> Response:
+	try:
+		catalog = await catalog_cache.get()
+	except UpstreamTimeout as e:
+		raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+	except CircuitOpenError:
+		raise
+	except Exception as e:
+		# Only reached with nothing cached to fall back on
+		if is_stripe_failure(e):
+			raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Stripe is unavailable.")
+		raise
+
+	if catalog is None:
 		logger.warning("No product available on Stripe.")
 		raise HTTPException(status_code=404, detail="No subscriptions found")
 
-	return SubscriptionsResponse(subscriptions=subscriptions)
+	return catalog.to_response(request)
 
 
-async def checkout_success(request: Request):
-	return payment_templates.TemplateResponse("success.html", {"request": request})
+async def checkout_success(request: Request) -> Response:
+	return request.app.state.documents["checkout_success"].to_response(request)
 
 
-async def checkout_failure(request: Request):
-	return payment_templates.TemplateResponse("failure.html", {"request": request})
+async def checkout_failure(request: Request) -> Response:
+	return request.app.state.documents["checkout_failure"].to_response(request)
 
 
 async def create_payment_link_func(
 		payment_link_request: CreatePaymentLinkRequest,
 		request: Request,
 		headers: Optional[Dict] = Depends(get_headers_dict),
+		stripe_with_auth0: StripeWithAuth0 = Depends(get_stripe_with_auth0),
 ) -> LinkResponse:
 
 	authorization = headers.get('authorization')
@@ -45,14 +152,11 @@ async def create_payment_link_func(
 		logger.warning("Authorization header not found.")
 		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Authorization header not found.")
 	try:
-		logger.info(f"Decoding token...")
-		logger.info(f"TOKEN: \n {authorization}")
-
 		token_data = await get_token_data(authorization)
 		# Create a Stripe Checkout session
-		logger.info(f"Creating Stripe checkout session for {token_data.get('sub')}")
+		logger.info("Creating Stripe checkout session for %s", token_data.get('sub'))
 
-		checkout_url = stripe_with_auth0.create_stripe_checkout_session(
+		checkout_url = await stripe_with_auth0.create_stripe_checkout_session(
 			price_id=payment_link_request.price_id,
 			success_url=f"{settings.BASE_URL}/payment/success",
 			cancel_url=f"{settings.BASE_URL}/payment/failure",
@@ -67,6 +171,10 @@ async def create_payment_link_func(
 			detail = f"The price ID {payment_link_request.price_id} is invalid."
 		raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
 
+	except UpstreamTimeout as e:
+		raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+	except (CircuitOpenError, RateLimitExceeded):
+		raise
 	except Exception as e:
 		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
 
@@ -74,22 +182,20 @@ async def create_payment_link_func(
 async def create_customer_portal_func(
 		request: Request,
 		headers: Optional[Dict] = Depends(get_headers_dict),
+		stripe_with_auth0: StripeWithAuth0 = Depends(get_stripe_with_auth0),
 ) -> LinkResponse:
 
 	authorization = headers.get('authorization')
-	logger.info(f"authorization:\n{authorization}")
 	if authorization is None:
 		logger.warning("Authorization header not found.")
 		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Authorization header not found.")
 
 	try:
-		logger.info(f"Decoding token...")
 		token_data = await get_token_data(authorization)
-		logger.info(f"Token decoded.")
 
 		# Create a Stripe Checkout session
-		logger.info(f"Creating Stripe portal link for {token_data.get('sub')}")
-		portal_link = stripe_with_auth0.get_portal_link(
+		logger.info("Creating Stripe portal link for %s", token_data.get('sub'))
+		portal_link = await stripe_with_auth0.get_portal_link(
 			user_id=token_data.get('sub')
 		)
 		return LinkResponse(url=portal_link)
@@ -98,5 +204,26 @@ async def create_customer_portal_func(
 		detail = str(e)
 		raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
 
+	except UpstreamTimeout as e:
+		raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+	except (CircuitOpenError, RateLimitExceeded):
+		raise
 	except Exception as e:
 		raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
+
+
+async def stripe_webhook_func(request: Request, stripe_signature: Optional[str] = Header(None)):
+	if not settings.STRIPE_WEBHOOK_SECRET:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stripe webhook is not configured.")
+
+	payload = await request.body()
+	try:
+		event = stripe.Webhook.construct_event(payload, stripe_signature, settings.STRIPE_WEBHOOK_SECRET)
+	except ValueError:
+		raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid payload.")
+	except SignatureVerificationError:
+		logger.warning("Stripe webhook signature verification failed.")
+		raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid signature.")
+
+	handled = handle_stripe_event(event)
+	return {"received": True, "handled": handled}
@@ -1,13 +1,59 @@
-from fastapi import Request
+import json
+import math
+from typing import Dict
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.templating import Jinja2Templates
 
 from src.core.config import settings
+from src.core.metrics import metrics
+from src.core.responses import PrecomputedResponse
+from src.core.static import static_assets
+from src.helpers.circuit import CircuitOpenError, breakers, OPEN
+from src.helpers.ratelimit import RateLimitExceeded
 
 plugin_templates = Jinja2Templates(directory="src/templates")
 
 
-async def healthcheck():
-	return {"status": "ok"}
+def render_page(templates: Jinja2Templates, name: str) -> PrecomputedResponse:
+	"""Render a template that does not depend on the request once, with its compressed variants."""
+	return PrecomputedResponse(
+		templates.get_template(name).render().encode(),
+		media_type="text/html",
+		cache_control=f"public, max-age={settings.DOCUMENT_MAX_AGE}",
+	)
+
+
+async def healthcheck(request: Request):
+	# Stays 200 while an upstream is down: the process itself is fine and still serves cached data
+	upstreams = {name: breaker.stats() for name, breaker in breakers.items()}
+	degraded = any(upstream["state"] == OPEN for upstream in upstreams.values())
+	return {
+		"status": "degraded" if degraded else "ok",
+		"upstreams": upstreams,
+		"auth0_outbox": request.app.state.stripe_with_auth0.metadata_outbox.stats(),
+	}
+
+
+async def circuit_open_handler(request: Request, exc: CircuitOpenError) -> Response:
+	return JSONResponse(
+		status_code=503,
+		content={"detail": str(exc)},
+		headers={"Retry-After": str(math.ceil(exc.retry_after))},
+	)
+
+
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded) -> Response:
+	return JSONResponse(
+		status_code=503,
+		content={"detail": str(exc)},
+		headers={"Retry-After": str(math.ceil(exc.retry_after))},
+	)
+
+
+async def metrics_endpoint() -> Response:
+	return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 def get_headers_dict(request: Request):
@@ -15,7 +61,7 @@ def get_headers_dict(request: Request):
 	return headers_dict
 
 
-async def ai_plugin_manifest():
+def build_ai_plugin_manifest() -> dict:
 	return {
 		"schema_version": "v1",
 		"name_for_human": settings.NAME_HUMAN,
@@ -38,15 +84,45 @@ async def ai_plugin_manifest():
 			"url": f"{settings.BASE_URL}/{settings.OPENAPI_PATH}",
 			"is_user_authenticated": True
 		},
-		"logo_url": f"{settings.BASE_URL}/static/images/logo.png",
+		"logo_url": f"{settings.BASE_URL}{static_assets.url('images/logo.png')}",
 		"contact_email": "info@robofastplugin.com",
 		"legal_info_url": f"{settings.BASE_URL}/legal"
 	}
 
 
-async def legal(request: Request):
-	return plugin_templates.TemplateResponse("legal.html", {"request": request})
+def build_plugin_documents() -> Dict[str, PrecomputedResponse]:
+	"""
+	Encode the manifest, which only depends on settings, and render the home and legal pages. Run by the lifespan.
+	"""
+	return {
+		"ai_plugin_manifest": PrecomputedResponse(
+			json.dumps(build_ai_plugin_manifest()).encode(),
+			cache_control=f"public, max-age={settings.DOCUMENT_MAX_AGE}",
+		),
+		"legal": render_page(plugin_templates, "legal.html"),
+		"home": render_page(plugin_templates, "home.html"),
+	}
+
+
+async def ai_plugin_manifest(request: Request) -> Response:
+	return request.app.state.documents["ai_plugin_manifest"].to_response(request)
+
+
+async def openapi_json(request: Request) -> Response:
+	return request.app.state.openapi_json.to_response(request)
+
+
+async def openapi_yaml(request: Request) -> Response:
+	return request.app.state.openapi_yaml.to_response(request)
+
+
+async def api_docs():
+	return get_swagger_ui_html(openapi_url=f"/{settings.OPENAPI_JSON_PATH}", title=f"{settings.OPENAPI_TITLE} - Docs")
+
+
+async def legal(request: Request) -> Response:
+	return request.app.state.documents["legal"].to_response(request)
 
 
-async def home_page(request: Request):
-	return plugin_templates.TemplateResponse("home.html", {"request": request})
+async def home_page(request: Request) -> Response:
+	return request.app.state.documents["home"].to_response(request)
@@ -1,58 +1,189 @@
-import httpx
+import asyncio
+import importlib.util
+import random
 import time
+import httpx
 
 from src.core.config import settings, logger
+from src.core.metrics import observe_upstream, upstream_retries
+from src.helpers.cache import SingleFlight
+from src.helpers.circuit import CircuitBreaker, CircuitOpenError
+from src.helpers.ratelimit import RateGovernor, RateLimitExceeded
+
+# HTTP/2 needs the optional `h2` package (httpx[http2]); fall back to HTTP/1.1 keep-alive without it
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def is_auth0_failure(e: BaseException) -> bool:
+	# A 429 comes from a healthy tenant and is handled by the rate governor
+	if isinstance(e, httpx.HTTPStatusError):
+		return e.response.status_code >= 500
+	return isinstance(e, httpx.RequestError)
+
+
+# Shared by the Management API client and the JWKS fetch
+auth0_breaker = CircuitBreaker("auth0", is_failure=is_auth0_failure)
+# Paces every Management API call of the process to stay within the tenant's rate limit
+auth0_governor = RateGovernor(
+	"auth0", rate=settings.AUTH0_MGM_RATE_LIMIT, burst=settings.AUTH0_MGM_RATE_BURST,
+	max_wait=settings.AUTH0_MGM_RATE_MAX_WAIT,
+)
 
 
 class Auth0RequestError(Exception):
 	"""Custom exception for Auth0 request errors."""
 
+	def __init__(self, message, status_code=None):
+		super().__init__(message)
+		self.status_code = status_code
+
+
+class ManagementTokenManager:
+	"""
+	Keeps the client-credentials token of the Management API valid.
+
+	The token is fetched on first use, renewed in the background `renew_margin` seconds before it
+	expires, and concurrent callers share a single in-flight renewal.
+	"""
+
+	RETRY_INTERVAL = 10  # seconds between background renewal attempts after a failure
+
+	def __init__(self, fetch_token, renew_margin: int = None):
+		self._fetch_token = fetch_token  # async callable returning (access_token, expires_in)
+		self.renew_margin = renew_margin if renew_margin is not None else settings.AUTH0_MGM_TOKEN_RENEW_MARGIN
+		self.token = None
+		self.expires_at = 0.0
+		self._single_flight = SingleFlight()
+		self._renew_task = None
+
+	async def get_token(self) -> str:
+		if self.token is None or time.monotonic() >= self.expires_at:
+			await self.refresh()
+		self._ensure_background_renewal()
+		return self.token
+
+	async def refresh(self, stale_token: str = None):
+		"""
+		Fetch a new token. When `stale_token` is given the fetch is skipped if another caller already replaced it.
+		"""
+		if stale_token is not None and stale_token != self.token:
+			return
+		await self._single_flight.do("token", self._renew)
+
+	async def _renew(self):
+		token, expires_in = await self._fetch_token()
+		if not token:
+			raise Auth0RequestError("Auth0 did not return a management API token.")
+		self.token = token
+		self.expires_at = time.monotonic() + expires_in
+		logger.info("Management API token renewed, valid for %ss", expires_in)
+
+	def _ensure_background_renewal(self):
+		if self._renew_task is None or self._renew_task.done():
+			self._renew_task = asyncio.get_running_loop().create_task(self._renew_loop())
+
+	async def _renew_loop(self):
+		while True:
+			delay = self.expires_at - self.renew_margin - time.monotonic()
+			await asyncio.sleep(max(delay, self.RETRY_INTERVAL))
+			try:
+				await self.refresh()
+			except (Auth0RequestError, CircuitOpenError, RateLimitExceeded) as exc:
+				logger.warning("Background renewal of the management API token failed: %s", exc)
+
+	async def aclose(self):
+		if self._renew_task is not None:
+			self._renew_task.cancel()
+			self._renew_task = None
+
 
 class Auth0UserManagement:
 	def __init__(self):
 		self.domain = settings.AUTH0_DOMAIN
+		self.base_url = settings.auth0_base_url
 		self.client_id = settings.AUTH0_MGM_CLIENT_ID
 		self.client_secret = settings.AUTH0_MGM_CLIENT_SECRET
-		self.token = self._get_management_api_token()
+		# One long-lived client so every management call reuses pooled keep-alive connections
+		self.client = httpx.AsyncClient(
+			http2=HTTP2_AVAILABLE,
+			timeout=self.REQUEST_TIMEOUT,
+			limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+		)
+		self.token_manager = ManagementTokenManager(self._get_management_api_token)
 
 	MAX_RETRIES = 3
-	RETRY_DELAY = 1  # seconds
+	MAX_RATE_LIMITED_RETRIES = 5  # 429 answers retried after the reset, on top of MAX_RETRIES
+	RETRY_BASE_DELAY = 0.5  # seconds, doubled on every retry
+	RETRY_MAX_DELAY = 5  # seconds
+	REQUEST_TIMEOUT = 10  # seconds
+
+	def _retry_delay(self, attempt: int) -> float:
+		# Exponential backoff with full jitter
+		return random.uniform(0, min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * 2 ** attempt))
 
-	def _make_request(self, method, url, headers=None, json=None):
+	async def _make_request(self, method, url, headers=None, json=None, timeout=None, operation="request"):
 		client_error = None  # Variable to store client error
+		attempt = 0
+		rate_limited = 0
 
-		for i in range(self.MAX_RETRIES):
+		while attempt < self.MAX_RETRIES:
+			# Refused calls must not queue for, nor use up, a rate slot
+			auth0_breaker.check()
+			# Queues behind earlier calls, or raises RateLimitExceeded when the wait would be too long
+			await auth0_governor.acquire()
+			started = time.perf_counter()
 			try:
-				response = httpx.request(method, url, headers=headers, json=json)
-				response.raise_for_status()
+				# Fails fast, without retrying, once the breaker has opened
+				with auth0_breaker.guard():
+					response = await self.client.request(
+						method, url, headers=headers, json=json, timeout=timeout or self.REQUEST_TIMEOUT
+					)
+					auth0_governor.observe(response.headers)
+					response.raise_for_status()
+				observe_upstream("auth0", operation, started)
 				return response
+			except CircuitOpenError:
+				raise
 			except httpx.HTTPStatusError as e:
+				if e.response.status_code == 429 and rate_limited < self.MAX_RATE_LIMITED_RETRIES:
+					# Not counted as an attempt: the next acquire waits until the advertised reset
+					observe_upstream("auth0", operation, started, "rate_limited")
+					upstream_retries.inc("auth0", operation)
+					rate_limited += 1
+					auth0_governor.pause_until_reset(e.response.headers, default=self._retry_delay(rate_limited))
+					continue
 				if 400 <= e.response.status_code < 500:
 					# For client errors, store the error and break the loop
+					observe_upstream("auth0", operation, started, "client_error")
 					client_error = e
 					break
-				else:
-					# For server errors, log the error and retry
-					logger.error(f"Server error: {e}. Retrying...")
-					time.sleep(self.RETRY_DELAY)
+				# For server errors, log the error and retry
+				observe_upstream("auth0", operation, started, "server_error")
+				logger.error("Server error: %s. Retrying...", e)
 			except httpx.RequestError as e:
 				# For request errors, log the error and retry
-				logger.error(f"Request failed: {e}. Retrying...")
-				time.sleep(self.RETRY_DELAY)
+				observe_upstream("auth0", operation, started, "network_error")
+				logger.error("Request failed: %s. Retrying...", e)
 			except Exception as e:
 				# For other exceptions, log the error and raise Auth0RequestError
-				logger.error(f"Unexpected error: {e}")
+				observe_upstream("auth0", operation, started, "error")
+				logger.error("Unexpected error: %s", e)
 				raise Auth0RequestError(f"Failed to make request: {e}")
 
+			attempt += 1
+			if attempt < self.MAX_RETRIES:
+				upstream_retries.inc("auth0", operation)
+				await asyncio.sleep(self._retry_delay(attempt - 1))
+
 		if client_error:  # Check if a client error occurred
-			logger.error(f"Client error: {client_error}; Status code: {client_error.response.status_code}")
-			raise Auth0RequestError(f"Client error: {client_error}")
+			logger.error("Client error: %s; Status code: %s", client_error, client_error.response.status_code)
+			raise Auth0RequestError(f"Client error: {client_error}", status_code=client_error.response.status_code)
 
 		logger.error("Max retries reached. Request failed.")
 		raise Auth0RequestError("Max retries reached. Request failed.")
 
-	def _get_management_api_token(self):
-		url = f"https://{self.domain}/oauth/token"
+	async def _get_management_api_token(self):
+		url = f"{self.base_url}/oauth/token"
 		headers = {"Content-Type": "application/json"}
 		payload = {
 			"client_id": self.client_id,
@@ -61,28 +192,47 @@ class Auth0UserManagement:
 			"grant_type": "client_credentials"
 		}
 
-		response = self._make_request("POST", url, headers=headers, json=payload)
-		if response:
-			return response.json().get("access_token")
-		return None
+		response = await self._make_request("POST", url, headers=headers, json=payload, operation="oauth_token")
+		token_data = response.json()
+		return token_data.get("access_token"), token_data.get("expires_in", 86400)
+
+	async def get_token(self):
+		return await self.token_manager.get_token()
+
+	async def _make_authorized_request(self, method, url, headers=None, json=None, timeout=None, operation="request"):
+		token = await self.get_token()
+		try:
+			return await self._make_request(
+				method, url, headers={**(headers or {}), "Authorization": f"Bearer {token}"}, json=json, timeout=timeout,
+				operation=operation,
+			)
+		except Auth0RequestError as e:
+			if e.status_code != 401:
+				raise
+		# The token was revoked or expired early: renew it once and retry
+		logger.warning("Management API rejected the token, renewing it and retrying")
+		await self.token_manager.refresh(stale_token=token)
+		token = await self.get_token()
+		return await self._make_request(
+			method, url, headers={**(headers or {}), "Authorization": f"Bearer {token}"}, json=json, timeout=timeout,
+			operation=operation,
+		)
 
-	def get_user_info(self, user_id):
-		url = f"https://{self.domain}/api/v2/users/{user_id}"
-		headers = {"Authorization": f"Bearer {self.token}"}
+	async def get_user_info(self, user_id, timeout=None):
+		url = f"{self.base_url}/api/v2/users/{user_id}"
 		try:
-			response = self._make_request("GET", url, headers=headers)
+			response = await self._make_authorized_request("GET", url, timeout=timeout, operation="get_user")
+		except (CircuitOpenError, RateLimitExceeded):
+			raise
 		except Exception as e:
 			raise Auth0RequestError(f"Failed to get user info for user_id: {user_id}. Error: {e}")
 		if response:
 			return response.json()
 		raise Auth0RequestError(f"Failed to get user info for user_id: {user_id}")
 
-	def update_user_metadata(self, user_id, app_metadata=None, user_metadata=None):
-		url = f"https://{self.domain}/api/v2/users/{user_id}"
-		headers = {
-			"Authorization": f"Bearer {self.token}",
-			"Content-Type": "application/json"
-		}
+	async def update_user_metadata(self, user_id, app_metadata=None, user_metadata=None, timeout=None):
+		url = f"{self.base_url}/api/v2/users/{user_id}"
+		headers = {"Content-Type": "application/json"}
 		payload = {}
 		if app_metadata is not None:
 			payload["app_metadata"] = app_metadata
@@ -92,8 +242,40 @@ class Auth0UserManagement:
 		if not payload:
 			raise ValueError(f"app_metadata and user_metadata cannot both be None. user_id: {user_id}")
 
-		response = self._make_request("PATCH", url, headers=headers, json=payload)
+		response = await self._make_authorized_request(
+			"PATCH", url, headers=headers, json=payload, timeout=timeout, operation="update_user"
+		)
 		if response:
 			return response.json()
 		raise Auth0RequestError(f"Failed to update user metadata for user_id: {user_id}")
 
+	async def search_users(self, query: str, fields: str, page: int, per_page: int = 100):
+		"""One page of a user search; the response has `users` and, with include_totals, `total`."""
+		url = f"{self.base_url}/api/v2/users"
+		params = {
+			"q": query, "search_engine": "v3", "fields": fields, "include_fields": "true", "page": page,
+			"per_page": per_page, "include_totals": "true",
+		}
+		response = await self._make_authorized_request(
+			"GET", f"{url}?{httpx.QueryParams(params)}", operation="search_users"
+		)
+		return response.json()
+
+	async def create_users_export(self, fields):
+		"""Start a job exporting `fields` of every user as gzipped NDJSON."""
+		url = f"{self.base_url}/api/v2/jobs/users-exports"
+		response = await self._make_authorized_request(
+			"POST", url, headers={"Content-Type": "application/json"}, json={"format": "json", "fields": fields},
+			operation="create_users_export",
+		)
+		return response.json()
+
+	async def get_job(self, job_id: str):
+		url = f"{self.base_url}/api/v2/jobs/{job_id}"
+		response = await self._make_authorized_request("GET", url, operation="get_job")
+		return response.json()
+
+	async def aclose(self):
+		await self.token_manager.aclose()
+		await self.client.aclose()
+
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from src.core.metrics import metrics
+
+cache_requests = metrics.counter(
+	"robofast_cache_requests_total", "Lookups of a named in-memory cache by result, hit or miss.", ("cache", "result")
+)
+cache_entries = metrics.gauge("robofast_cache_entries", "Entries held by a named in-memory cache.", ("cache",))
+
+
+class SingleFlight:
+	"""Collapse concurrent calls for the same key into a single in-flight awaitable."""
+
+	def __init__(self):
+		self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+	def in_flight(self, key: Hashable) -> bool:
+		return key in self._inflight
+
+	async def do(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+		future = self._inflight.get(key)
+		if future is None:
+			future = asyncio.ensure_future(func(*args, **kwargs))
+			self._inflight[key] = future
+			future.add_done_callback(lambda done: self._forget(key, done))
+		# Shield so a cancelled caller does not cancel the work shared with the others
+		return await asyncio.shield(future)
+
+	def _forget(self, key: Hashable, future: asyncio.Future):
+		if self._inflight.get(key) is future:
+			del self._inflight[key]
+		if not future.cancelled():
+			# Mark the exception as retrieved even if every waiter went away
+			future.exception()
+
+
+class KeyedLock:
+	"""Per-key asyncio locks, dropped again once nobody holds or waits for them."""
+
+	def __init__(self):
+		self._locks: Dict[Hashable, asyncio.Lock] = {}
+		self._users: Dict[Hashable, int] = {}
+
+	@asynccontextmanager
+	async def lock(self, key: Hashable) -> AsyncIterator[None]:
+		lock = self._locks.setdefault(key, asyncio.Lock())
+		self._users[key] = self._users.get(key, 0) + 1
+		try:
+			async with lock:
+				yield
+		finally:
+			self._users[key] -= 1
+			if not self._users[key]:
+				del self._users[key]
+				del self._locks[key]
+
+
+class TTLCache:
+	"""Bounded LRU cache whose entries expire after their own TTL. A `name` exports its hits, misses and size."""
+
+	def __init__(self, maxsize: int, ttl: Optional[float] = None, name: Optional[str] = None):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.name = name
+		self.hits = 0
+		self.misses = 0
+		self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+		self._lock = threading.Lock()
+		if name is not None:
+			cache_entries.set_function(lambda: len(self._data), name)
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+	def get(self, key: Hashable, default: Any = None) -> Any:
+		with self._lock:
+			entry = self._data.get(key)
+			if entry is not None:
+				if entry[0] > time.monotonic():
+					self._data.move_to_end(key)
+					self.hits += 1
+					if self.name is not None:
+						cache_requests.inc(self.name, "hit")
+					return entry[1]
+				del self._data[key]
+			self.misses += 1
+			if self.name is not None:
+				cache_requests.inc(self.name, "miss")
+			return default
+
+	def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+		ttl = self.ttl if ttl is None else ttl
+		if ttl is None:
+			raise ValueError("A TTL is required when the cache has no default TTL.")
+		if ttl <= 0:
+			return
+		with self._lock:
+			self._data[key] = (time.monotonic() + ttl, value)
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def pop(self, key: Hashable, default: Any = None) -> Any:
+		with self._lock:
+			entry = self._data.pop(key, None)
+		return default if entry is None else entry[1]
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+
+	def items(self) -> List[Tuple[Hashable, Any, float]]:
+		"""(key, value, remaining TTL) of every live entry, least recently used first."""
+		now = time.monotonic()
+		with self._lock:
+			return [(key, value, expires_at - now) for key, (expires_at, value) in self._data.items() if expires_at > now]
+
+	def stats(self) -> Dict[str, int]:
+		return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
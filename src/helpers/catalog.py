@@ -0,0 +1,102 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from src.core.config import settings, logger
+from src.core.responses import PrecomputedResponse
+from src.core.schema import SubscriptionsResponse
+from src.helpers.cache import SingleFlight
+from src.helpers.circuit import CircuitOpenError
+from src.helpers.payment import StripeProductPriceFetcher, is_stripe_failure, stripe_executor
+
+
+class CatalogCache:
+	"""
+	In-process copy of the Stripe product/price catalog, kept as a pre-serialized SubscriptionsResponse.
+
+	A fresh copy is served straight from memory. Once it is older than `ttl` it is still served for up to
+	`stale_ttl` seconds while a background refresh runs. Concurrent misses share a single upstream fetch.
+	"""
+
+	def __init__(self, fetcher: StripeProductPriceFetcher, ttl: int = None, stale_ttl: int = None):
+		self.fetcher = fetcher
+		self.ttl = ttl if ttl is not None else settings.CATALOG_CACHE_TTL
+		self.stale_ttl = stale_ttl if stale_ttl is not None else settings.CATALOG_STALE_TTL
+		self.document: Optional[PrecomputedResponse] = None
+		self.products: Dict[str, Dict] = {}
+		self._loaded_at: Optional[float] = None
+		self._single_flight = SingleFlight()
+
+	async def get(self) -> Optional[PrecomputedResponse]:
+		"""
+		Return the cached catalog document, or None when Stripe has no products.
+		"""
+		if self._loaded_at is not None:
+			age = time.monotonic() - self._loaded_at
+			if age < self.ttl:
+				return self.document
+			if age < self.ttl + self.stale_ttl:
+				self._revalidate()
+				return self.document
+		try:
+			return await self.refresh()
+		except Exception as e:
+			if self.document is None or not (isinstance(e, CircuitOpenError) or is_stripe_failure(e)):
+				raise
+			# Stripe is down: an outdated catalog beats none
+			logger.warning("Stripe is unavailable, serving the last catalog: %s", e)
+			return self.document
+
+	async def refresh(self) -> Optional[PrecomputedResponse]:
+		return await self._single_flight.do("catalog", self._load)
+
+	async def get_product(self, product_id: str) -> Optional[Dict]:
+		await self.get()
+		return self.products.get(product_id)
+
+	def invalidate(self):
+		self._loaded_at = None
+
+	def _revalidate(self):
+		if not self._single_flight.in_flight("catalog"):
+			asyncio.get_running_loop().create_task(self._revalidate_quietly())
+
+	async def _revalidate_quietly(self):
+		try:
+			await self.refresh()
+		except Exception as e:
+			logger.warning("Background catalog refresh failed, serving stale catalog: %s", e)
+
+	async def _load(self) -> Optional[PrecomputedResponse]:
+		logger.info("Fetch product info from Stripe")
+		subscriptions = await stripe_executor.run(self.fetcher.fetch_products_and_prices)
+		self._set(subscriptions, loaded_at=time.monotonic())
+		return self.document
+
+	def _set(self, subscriptions: List[Dict], loaded_at: float):
+		self.products = {product["product_id"]: product for product in subscriptions}
+		if subscriptions:
+			body = SubscriptionsResponse(subscriptions=subscriptions).model_dump_json().encode()
+			self.document = PrecomputedResponse(body)
+		else:
+			self.document = None
+		self._loaded_at = loaded_at
+
+	def export_state(self) -> Optional[Dict]:
+		if self._loaded_at is None:
+			return None
+		return {"subscriptions": list(self.products.values()), "age": time.monotonic() - self._loaded_at}
+
+	def restore_state(self, state: Dict, age: float) -> bool:
+		"""
+		Adopt a catalog saved by an earlier process unless it is past its stale TTL; a stale one is served
+		while it is revalidated, as usual.
+		"""
+		total_age = state["age"] + age
+		if total_age >= self.ttl + self.stale_ttl or self._loaded_at is not None:
+			return False
+		self._set(state["subscriptions"], loaded_at=time.monotonic() - total_age)
+		return True
+
+
+catalog_cache = CatalogCache(fetcher=StripeProductPriceFetcher(api_key=settings.STRIPE_SECRET_KEY))
@@ -0,0 +1,69 @@
+import hashlib
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from src.core.config import settings
+from src.helpers.cache import SingleFlight, TTLCache
+
+# A reused URL must stay usable for a while after it is handed out
+EXPIRY_MARGIN = 60  # seconds
+
+
+def idempotency_key(prefix: str, *parts: Any) -> str:
+	digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()[:32]
+	return f"{prefix}-{digest}"
+
+
+class CheckoutSessionCache:
+	"""
+	Collapses repeated checkout requests of a user for the same price.
+
+	Concurrent requests share one in-flight creation and, for `window` seconds, later ones get the same
+	still-open session. Completed or expired sessions are dropped as soon as their webhook arrives.
+	"""
+
+	def __init__(self, window: int, maxsize: int):
+		self.window = window
+		self.sessions = TTLCache(maxsize=maxsize)
+		self._keys_by_session = TTLCache(maxsize=maxsize)
+		# Bumped when a session of the key completes, so the next one gets a fresh idempotency key
+		self._generations = TTLCache(maxsize=maxsize, ttl=2 * max(window, 1))
+		self._single_flight = SingleFlight()
+
+	def idempotency_key(self, key: Hashable, *parts: Any) -> Optional[str]:
+		"""
+		Same key for the same parameters within one window, so Stripe answers retries with the session it
+		already created, including retries from another worker process.
+		"""
+		if self.window <= 0:
+			return None
+		return idempotency_key(
+			"checkout", *parts, int(time.time() // self.window), self._generations.get(key, 0)
+		)
+
+	async def get_or_create(self, key: Hashable, create: Callable[[], Awaitable[Any]]) -> Any:
+		session = self.sessions.get(key)
+		if session is not None:
+			return session
+		return await self._single_flight.do(key, self._create, key, create)
+
+	async def _create(self, key: Hashable, create: Callable[[], Awaitable[Any]]) -> Any:
+		session = await create()
+		ttl = self.window
+		expires_at = session.get("expires_at")
+		if expires_at:
+			ttl = min(ttl, expires_at - time.time() - EXPIRY_MARGIN)
+		self.sessions.set(key, session, ttl)
+		self._keys_by_session.set(session["id"], key, ttl)
+		return session
+
+	def forget_session(self, session_id: str):
+		key = self._keys_by_session.pop(session_id)
+		if key is not None:
+			self.sessions.pop(key)
+			self._generations.set(key, self._generations.get(key, 0) + 1)
+
+
+checkout_sessions = CheckoutSessionCache(
+	window=settings.CHECKOUT_REUSE_WINDOW, maxsize=settings.CHECKOUT_SESSION_CACHE_SIZE
+)
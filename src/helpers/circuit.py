@@ -0,0 +1,125 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator
+
+from src.core.config import settings, logger
+from src.core.metrics import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Every breaker by upstream name, reported by the health endpoint
+breakers: Dict[str, "CircuitBreaker"] = {}
+
+circuit_state = metrics.gauge(
+	"robofast_circuit_breaker_open", "1 while the circuit breaker of an upstream is open, 0.5 while half-open.",
+	("upstream",),
+)
+
+
+class CircuitOpenError(Exception):
+	"""Raised instead of calling an upstream whose circuit breaker is open."""
+
+	def __init__(self, upstream: str, retry_after: float):
+		super().__init__(f"{upstream} is unavailable, retry in {retry_after:.0f}s")
+		self.upstream = upstream
+		self.retry_after = retry_after
+
+
+class CircuitBreaker:
+	"""
+	Closed/open/half-open breaker guarding the calls to one upstream.
+
+	After `failure_threshold` consecutive failures the circuit opens and calls fail immediately with
+	CircuitOpenError. Once `recovery_timeout` seconds have passed a single probe call is let through: its
+	success closes the circuit again, its failure reopens it. `is_failure` decides which exceptions mean
+	the upstream is unhealthy; any other outcome counts as a success.
+	"""
+
+	def __init__(
+			self, name: str, is_failure: Callable[[BaseException], bool],
+			failure_threshold: int = None, recovery_timeout: float = None,
+	):
+		self.name = name
+		self.is_failure = is_failure
+		self.failure_threshold = failure_threshold or settings.CIRCUIT_FAILURE_THRESHOLD
+		self.recovery_timeout = recovery_timeout or settings.CIRCUIT_RECOVERY_TIMEOUT
+		self.state = CLOSED
+		self.failures = 0
+		self.opened_at = 0.0
+		self.times_opened = 0
+		self._probing = False
+		self._lock = threading.Lock()
+		circuit_state.set_function(lambda: {CLOSED: 0, HALF_OPEN: 0.5, OPEN: 1}[self.state], name)
+		breakers[name] = self
+
+	def retry_after(self) -> float:
+		return max(self.opened_at + self.recovery_timeout - time.monotonic(), 1)
+
+	def check(self):
+		"""Raise CircuitOpenError if a call would be refused right now, without claiming the probe."""
+		if self.state == OPEN and time.monotonic() - self.opened_at < self.recovery_timeout:
+			raise CircuitOpenError(self.name, self.retry_after())
+		if self.state == HALF_OPEN and self._probing:
+			raise CircuitOpenError(self.name, 1)
+
+	def before_call(self):
+		with self._lock:
+			if self.state == OPEN:
+				if time.monotonic() - self.opened_at < self.recovery_timeout:
+					raise CircuitOpenError(self.name, self.retry_after())
+				self.state = HALF_OPEN
+			if self.state == HALF_OPEN:
+				if self._probing:
+					raise CircuitOpenError(self.name, 1)
+				self._probing = True
+
+	def record_success(self):
+		with self._lock:
+			if self.state != CLOSED:
+				logger.info("Circuit breaker of %s closed", self.name)
+			self.state = CLOSED
+			self.failures = 0
+			self._probing = False
+
+	def record_failure(self):
+		with self._lock:
+			self.failures += 1
+			self._probing = False
+			if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+				self.state = OPEN
+				self.opened_at = time.monotonic()
+				self.times_opened += 1
+				logger.warning("Circuit breaker of %s opened after %d failures", self.name, self.failures)
+
+	def _release(self):
+		# The call was cancelled before it told us anything about the upstream
+		with self._lock:
+			self._probing = False
+
+	@contextmanager
+	def guard(self) -> Iterator[None]:
+		"""
+		Wrap a single upstream call: raises CircuitOpenError while open, records the outcome otherwise.
+		"""
+		self.before_call()
+		try:
+			yield
+		except Exception as e:
+			if self.is_failure(e):
+				self.record_failure()
+			else:
+				self.record_success()
+			raise
+		except BaseException:
+			self._release()
+			raise
+		self.record_success()
+
+	def stats(self) -> Dict[str, object]:
+		stats = {"state": self.state, "consecutive_failures": self.failures, "times_opened": self.times_opened}
+		if self.state == OPEN:
+			stats["retry_after"] = round(self.retry_after())
+		return stats
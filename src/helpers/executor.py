@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from src.core.metrics import metrics, observe_upstream, upstream_timeouts
+
+executor_queue_depth = metrics.gauge(
+	"robofast_executor_queue_depth", "Calls waiting for a free worker thread.", ("executor",)
+)
+executor_in_flight = metrics.gauge(
+	"robofast_executor_in_flight", "Calls running on a worker thread.", ("executor",)
+)
+
+
+def operation_name(func: Callable) -> str:
+	"""Metric label of a call: "customer.create", "checkout.session.create", "CatalogCache._load"."""
+	owner = getattr(func, "__self__", None)
+	if isinstance(owner, type):
+		return f"{getattr(owner, 'OBJECT_NAME', owner.__name__)}.{func.__name__}"
+	return getattr(func, "__qualname__", type(func).__name__)
+
+
+class UpstreamTimeout(Exception):
+	"""Raised when a call on a BoundedExecutor does not finish within its timeout."""
+
+
+class BoundedExecutor:
+	"""
+	Dedicated, size-limited thread pool for blocking SDK calls made from async code.
+
+	Each call is bounded by a timeout that covers both the wait in the queue and the call itself, so
+	latency stays bounded when a burst of requests queues up behind the workers. The threads are started on
+	first use, and again after `shutdown`.
+	"""
+
+	def __init__(self, name: str, max_workers: int, timeout: float, breaker=None):
+		self.name = name
+		self.breaker = breaker  # optional CircuitBreaker every call goes through
+		self.max_workers = max_workers
+		self.timeout = timeout
+		self._executor: Optional[ThreadPoolExecutor] = None
+		self._lock = threading.Lock()
+		self.submitted = 0
+		self.started = 0
+		self.finished = 0
+		self.timeouts = 0
+		executor_queue_depth.set_function(lambda: self.queue_depth, name)
+		executor_in_flight.set_function(lambda: self.in_flight, name)
+
+	@property
+	def queue_depth(self) -> int:
+		"""Calls waiting for a free worker."""
+		return self.submitted - self.started
+
+	@property
+	def in_flight(self) -> int:
+		"""Calls currently running on a worker."""
+		return self.started - self.finished
+
+	def _pool(self) -> ThreadPoolExecutor:
+		with self._lock:
+			if self._executor is None:
+				self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+			return self._executor
+
+	def _call(self, func: Callable, args, kwargs):
+		with self._lock:
+			self.started += 1
+		started = time.perf_counter()
+		outcome = "error"
+		try:
+			result = func(*args, **kwargs)
+			outcome = "ok"
+			return result
+		finally:
+			observe_upstream(self.name, operation_name(func), started, outcome)
+			with self._lock:
+				self.finished += 1
+
+	async def run(self, func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+		if self.breaker is None:
+			return await self._run(func, args, kwargs, timeout)
+		with self.breaker.guard():
+			return await self._run(func, args, kwargs, timeout)
+
+	async def _run(self, func: Callable, args, kwargs, timeout: Optional[float]) -> Any:
+		with self._lock:
+			self.submitted += 1
+		future = self._pool().submit(self._call, func, args, kwargs)
+		try:
+			return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+		except asyncio.TimeoutError:
+			if future.cancel():
+				# Never started: keep the counters balanced
+				with self._lock:
+					self.started += 1
+					self.finished += 1
+			with self._lock:
+				self.timeouts += 1
+			upstream_timeouts.inc(self.name, operation_name(func))
+			raise UpstreamTimeout(f"{self.name} call {getattr(func, '__qualname__', func)} timed out")
+
+	def stats(self) -> Dict[str, int]:
+		return {
+			"max_workers": self.max_workers,
+			"queue_depth": self.queue_depth,
+			"in_flight": self.in_flight,
+			"completed": self.finished,
+			"timeouts": self.timeouts,
+		}
+
+	def shutdown(self):
+		with self._lock:
+			executor, self._executor = self._executor, None
+		if executor is not None:
+			executor.shutdown(wait=False, cancel_futures=True)
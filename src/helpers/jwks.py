@@ -0,0 +1,141 @@
+import asyncio
+import re
+import time
+from functools import cached_property
+from typing import Dict, Optional
+
+import httpx
+from jose import jwk
+
+from src.core.config import settings, logger
+from src.helpers.authentication import auth0_breaker
+from src.helpers.cache import SingleFlight
+from src.helpers.circuit import CircuitOpenError
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+
+class CachedJWK:
+	"""A single JWKS entry; the public key is parsed once per verification library and then reused."""
+
+	def __init__(self, jwk_dict: Dict):
+		self.jwk_dict = jwk_dict
+		self.kid = jwk_dict.get("kid")
+		self.alg = jwk_dict.get("alg") or settings.AUTH_ALGORITHM
+
+	@cached_property
+	def jose_key(self):
+		return jwk.construct(self.jwk_dict, algorithm=self.alg)
+
+	@cached_property
+	def pyjwt_key(self):
+		import jwt  # PyJWT is only needed by src.core.jwt
+		return jwt.PyJWK(self.jwk_dict).key
+
+
+class JWKSCache:
+	"""
+	Process-wide store of the Auth0 signing keys, keyed by `kid`.
+
+	Keys are fetched once and refreshed in the background following the Cache-Control max-age
+	of the JWKS response. A token signed with an unknown `kid` triggers a refetch, rate limited by
+	`min_refresh_interval`, and concurrent refetches share a single request.
+	"""
+
+	def __init__(self, base_url: str, default_ttl: int = None, min_refresh_interval: int = None):
+		self.jwks_url = f"{base_url}/.well-known/jwks.json"
+		self.default_ttl = default_ttl or settings.JWKS_CACHE_TTL
+		self.min_refresh_interval = min_refresh_interval or settings.JWKS_MIN_REFRESH_INTERVAL
+		self._keys: Dict[str, CachedJWK] = {}
+		self._ttl = self.default_ttl
+		self._last_fetch = 0.0
+		self._single_flight = SingleFlight()
+		self._client: Optional[httpx.AsyncClient] = None
+		self._refresh_task: Optional[asyncio.Task] = None
+
+	async def get_signing_key(self, kid: str) -> Optional[CachedJWK]:
+		if not self._keys:
+			await self.refresh()
+
+		key = self._keys.get(kid)
+		if key is None and time.monotonic() - self._last_fetch >= self.min_refresh_interval:
+			logger.info("Unknown signing key id %s, refetching JWKS", kid)
+			await self.refresh()
+			key = self._keys.get(kid)
+
+		self._ensure_background_refresh()
+		return key
+
+	async def refresh(self):
+		await self._single_flight.do("jwks", self._fetch)
+
+	async def _fetch(self):
+		self._last_fetch = time.monotonic()
+		if self._client is None:
+			self._client = httpx.AsyncClient(timeout=10)
+		with auth0_breaker.guard():
+			response = await self._client.get(self.jwks_url)
+			response.raise_for_status()
+
+		keys = {}
+		for key_dict in response.json().get("keys", []):
+			kid = key_dict.get("kid")
+			if not kid:
+				continue
+			current = self._keys.get(kid)
+			# Keep already parsed keys when the JWK itself did not change
+			keys[kid] = current if current is not None and current.jwk_dict == key_dict else CachedJWK(key_dict)
+
+		self._keys = keys
+		self._ttl = self._ttl_from_headers(response.headers)
+		logger.info("Loaded %d signing keys from JWKS, refreshing in %ss", len(keys), self._ttl)
+
+	def export_state(self) -> Optional[Dict]:
+		if not self._keys:
+			return None
+		age = time.monotonic() - self._last_fetch
+		return {"keys": [key.jwk_dict for key in self._keys.values()], "ttl": self._ttl - age}
+
+	def restore_state(self, state: Dict, age: float) -> bool:
+		"""Adopt keys saved by an earlier process if they are still within their TTL."""
+		remaining = state["ttl"] - age
+		if remaining <= 0 or self._keys:
+			return False
+		self._keys = {key_dict["kid"]: CachedJWK(key_dict) for key_dict in state["keys"] if key_dict.get("kid")}
+		# As if fetched `age` seconds ago, so the background refresh is due when the saved TTL runs out
+		self._ttl = state["ttl"]
+		self._last_fetch = time.monotonic() - age
+		return bool(self._keys)
+
+	def _ttl_from_headers(self, headers: httpx.Headers) -> int:
+		match = MAX_AGE_PATTERN.search(headers.get("cache-control", ""))
+		if not match:
+			return self.default_ttl
+		return min(max(int(match.group(1)), self.min_refresh_interval), self.default_ttl)
+
+	def _ensure_background_refresh(self):
+		if self._refresh_task is None or self._refresh_task.done():
+			self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+	async def _refresh_loop(self):
+		delay = max(self._ttl - (time.monotonic() - self._last_fetch), self.min_refresh_interval)
+		while True:
+			await asyncio.sleep(delay)
+			try:
+				await self.refresh()
+				delay = self._ttl
+			except (httpx.HTTPError, ValueError, CircuitOpenError) as exc:
+				# Keep serving the keys we have and try again soon
+				logger.warning("Background JWKS refresh failed: %s", exc)
+				delay = self.min_refresh_interval
+
+	async def aclose(self):
+		if self._refresh_task is not None:
+			self._refresh_task.cancel()
+			self._refresh_task = None
+		if self._client is not None:
+			await self._client.aclose()
+			self._client = None
+
+
+jwks_cache = JWKSCache(base_url=settings.auth0_base_url)
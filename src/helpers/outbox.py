@@ -0,0 +1,146 @@
+import asyncio
+import contextlib
+import json
+import random
+from typing import Dict, Optional
+
+from src.core.config import logger
+from src.core.metrics import metrics
+from src.helpers.authentication import Auth0RequestError, Auth0UserManagement
+from src.helpers.circuit import CircuitOpenError
+from src.helpers.ratelimit import RateLimitExceeded
+from src.helpers.store import SubscriptionStore
+
+outbox_pending = metrics.gauge(
+	"robofast_outbox_pending", "Updates waiting in an outbox for delivery to their upstream.", ("outbox",)
+)
+outbox_deliveries = metrics.counter(
+	"robofast_outbox_deliveries_total", "Outbox delivery attempts by outcome.", ("outbox", "outcome")
+)
+
+
+def is_permanent_failure(e: BaseException) -> bool:
+	# Auth0 rejected the update itself (unknown user, invalid payload): sending it again cannot help
+	status_code = getattr(e, "status_code", None)
+	return isinstance(e, Auth0RequestError) and status_code is not None and 400 <= status_code < 500 \
+		and status_code not in (401, 408, 429)
+
+
+class Auth0MetadataOutbox:
+	"""
+	Delivers app_metadata updates to Auth0 in the background, from a queue persisted in the subscription store.
+
+	Callers only write the update to SQLite and return. The worker sends due updates in batches of
+	`batch_size`, at most `concurrency` at a time, and reschedules failed ones with exponential backoff,
+	so updates survive Auth0 outages and restarts. Updates of the same user are merged while they wait.
+	"""
+
+	def __init__(
+			self, store: SubscriptionStore, auth0_manager: Auth0UserManagement, batch_size: int, concurrency: int,
+			poll_interval: float, max_backoff: float,
+	):
+		self.store = store
+		self.auth0_manager = auth0_manager
+		self.batch_size = batch_size
+		self.concurrency = concurrency
+		self.poll_interval = poll_interval
+		self.max_backoff = max_backoff
+		self._wake_up = asyncio.Event()
+		self._task: Optional[asyncio.Task] = None
+		outbox_pending.set_function(lambda: self.store.app_metadata_outbox_stats()["pending"], "auth0_app_metadata")
+
+	def enqueue(self, user_id: str, app_metadata: Dict):
+		self.store.enqueue_app_metadata(user_id, app_metadata)
+		self._wake_up.set()
+
+	def pending(self, user_id: str) -> Optional[Dict]:
+		"""The app_metadata update of the user that has not reached Auth0 yet, if any."""
+		return self.store.pending_app_metadata(user_id)
+
+	def stats(self) -> Dict[str, float]:
+		return self.store.app_metadata_outbox_stats()
+
+	def _backoff(self, attempts: int) -> float:
+		return random.uniform(0.5, 1) * min(self.max_backoff, self.poll_interval * 2 ** attempts)
+
+	async def _deliver(self, row, semaphore: asyncio.Semaphore) -> bool:
+		user_id = row["auth0_sub"]
+		async with semaphore:
+			try:
+				await self.auth0_manager.update_user_metadata(user_id, app_metadata=json.loads(row["app_metadata"]))
+			except CircuitOpenError as e:
+				# Not an attempt: nothing was sent
+				self.store.retry_app_metadata(user_id, str(e), max(e.retry_after, self.poll_interval))
+				outbox_deliveries.inc("auth0_app_metadata", "deferred")
+				return False
+			except RateLimitExceeded as e:
+				# Not an attempt either: our own pace toward Auth0 is used up for now
+				self.store.retry_app_metadata(user_id, str(e), max(e.retry_after, self.poll_interval))
+				outbox_deliveries.inc("auth0_app_metadata", "rate_limited")
+				return False
+			except Exception as e:
+				if is_permanent_failure(e):
+					logger.error("Dropping the app_metadata update of %s rejected by Auth0: %s", user_id, e)
+					self.store.complete_app_metadata(user_id, row["app_metadata"])
+					outbox_deliveries.inc("auth0_app_metadata", "rejected")
+					return False
+				delay = self._backoff(row["attempts"])
+				logger.warning(
+					"Delivering the app_metadata update of %s failed (attempt %d), retrying in %.0fs: %s",
+					user_id, row["attempts"] + 1, delay, e
+				)
+				self.store.retry_app_metadata(user_id, str(e), delay)
+				outbox_deliveries.inc("auth0_app_metadata", "failed")
+				return False
+		self.store.complete_app_metadata(user_id, row["app_metadata"])
+		outbox_deliveries.inc("auth0_app_metadata", "delivered")
+		logger.info("Stored app_metadata %s in Auth0 for %s", row["app_metadata"], user_id)
+		return True
+
+	async def flush(self) -> int:
+		"""Deliver every update that is due now and return how many reached Auth0."""
+		semaphore = asyncio.Semaphore(self.concurrency)
+		delivered = 0
+		while True:
+			rows = self.store.due_app_metadata(self.batch_size)
+			if not rows:
+				return delivered
+			results = await asyncio.gather(*(self._deliver(row, semaphore) for row in rows))
+			delivered += sum(results)
+			if not any(results) or len(rows) < self.batch_size:
+				# Failed rows were rescheduled; whatever is due again waits for the next pass
+				return delivered
+
+	def start(self):
+		if self._task is None:
+			self._task = asyncio.get_running_loop().create_task(self._run())
+
+	async def _run(self):
+		while True:
+			self._wake_up.clear()
+			try:
+				await self.flush()
+			except Exception as e:
+				logger.error("Auth0 app_metadata outbox pass failed: %s", e)
+			try:
+				await asyncio.wait_for(self._wake_up.wait(), timeout=self.poll_interval)
+			except asyncio.TimeoutError:
+				pass
+
+	async def stop(self, timeout: float):
+		"""Stop the worker after a last delivery pass of at most `timeout` seconds; the rest stays queued."""
+		if self._task is None:
+			return
+		self._task.cancel()
+		with contextlib.suppress(asyncio.CancelledError):
+			await self._task
+		self._task = None
+		try:
+			await asyncio.wait_for(self.flush(), timeout=timeout)
+		except asyncio.TimeoutError:
+			pass
+		except Exception as e:
+			logger.warning("Final Auth0 app_metadata outbox pass failed: %s", e)
+		stats = self.stats()
+		if stats["pending"]:
+			logger.info("%d Auth0 app_metadata updates stay queued for the next start", stats["pending"])
@@ -5,82 +5,205 @@ from typing import Optional, Dict, List
 from fastapi import HTTPException
 
 from src.core.config import settings, logger
+from src.core.metrics import upstream_retries
 from src.helpers.authentication import Auth0UserManagement
+from src.helpers.cache import KeyedLock, SingleFlight, TTLCache
+from src.helpers.checkout import checkout_sessions, idempotency_key
+from src.helpers.circuit import CircuitBreaker, CircuitOpenError
+from src.helpers.ratelimit import RateLimitExceeded
+from src.helpers.executor import BoundedExecutor, UpstreamTimeout
+from src.helpers.outbox import Auth0MetadataOutbox
+from src.helpers.store import subscription_store
+
+
+def is_stripe_failure(e: BaseException) -> bool:
+	# Card declines, invalid requests etc. come from a healthy Stripe
+	return isinstance(e, (
+		UpstreamTimeout, stripe.error.APIConnectionError, stripe.error.APIError, stripe.error.RateLimitError
+	))
+
+
+stripe_breaker = CircuitBreaker("stripe", is_failure=is_stripe_failure)
+# The Stripe SDK is synchronous: every call runs on this pool so it never blocks the event loop
+stripe_executor = BoundedExecutor(
+	name="stripe", max_workers=settings.STRIPE_MAX_WORKERS, timeout=settings.STRIPE_CALL_TIMEOUT,
+	breaker=stripe_breaker,
+)
+# Never let a worker hang longer than the callers are willing to wait for it
+stripe.default_http_client = stripe.http_client.RequestsClient(timeout=settings.STRIPE_CALL_TIMEOUT)
+if settings.STRIPE_API_BASE:
+	stripe.api_base = settings.STRIPE_API_BASE
 
 
 class StripeWithAuth0:
 	def __init__(self):
 		self.auth0_manager = Auth0UserManagement()
 		stripe.api_key = settings.STRIPE_SECRET_KEY
+		# Auth0 sub -> Stripe customer id, in front of the persistent mapping in the subscription store
+		self.customer_ids = TTLCache(
+			maxsize=settings.CUSTOMER_MAPPING_CACHE_SIZE, ttl=settings.CUSTOMER_MAPPING_TTL, name="customer_ids"
+		)
+		self._customer_locks = KeyedLock()
+		# Auth0 sub (or Stripe customer id) -> customer portal URL, reused while Stripe still accepts it
+		self.portal_links = TTLCache(
+			maxsize=settings.PORTAL_SESSION_CACHE_SIZE, ttl=settings.PORTAL_SESSION_REUSE_WINDOW, name="portal_links"
+		)
+		self._portal_single_flight = SingleFlight()
+		# Stripe ids are written back to Auth0 in the background, off the request path
+		self.metadata_outbox = Auth0MetadataOutbox(
+			subscription_store, self.auth0_manager, batch_size=settings.AUTH0_OUTBOX_BATCH_SIZE,
+			concurrency=settings.AUTH0_OUTBOX_CONCURRENCY, poll_interval=settings.AUTH0_OUTBOX_POLL_INTERVAL,
+			max_backoff=settings.AUTH0_OUTBOX_MAX_BACKOFF,
+		)
+
+	def _cached_customer_id(self, user_id: str) -> Optional[str]:
+		stripe_id = self.customer_ids.get(user_id)
+		if stripe_id is None:
+			stripe_id = subscription_store.get_customer_id(user_id, max_age=settings.CUSTOMER_MAPPING_TTL)
+			if stripe_id is not None:
+				self.customer_ids.set(user_id, stripe_id)
+		return stripe_id
+
+	def known_customer_id(self, user_id: str) -> Optional[str]:
+		"""The user's Stripe customer id if it is known locally, without calling Auth0 or Stripe."""
+		return self._cached_customer_id(user_id) or subscription_store.get_customer_id(user_id)
+
+	def _remember_customer_id(self, user_id: str, stripe_id: str):
+		subscription_store.set_customer(stripe_id, auth0_sub=user_id)
+		self.customer_ids.set(user_id, stripe_id)
 
-	def get_or_create_stripe_customer(self, user_id):
+	def forget_customer_id(self, user_id: str):
+		self.customer_ids.pop(user_id)
+		self.portal_links.pop(user_id)
+		subscription_store.forget_auth0_sub(user_id)
+
+	def export_state(self) -> Optional[Dict]:
+		entries = [[user_id, stripe_id, ttl] for user_id, stripe_id, ttl in self.customer_ids.items()]
+		return {"customer_ids": entries} if entries else None
+
+	def restore_state(self, state: Dict, age: float) -> bool:
+		"""Reload the in-memory customer id mappings saved by an earlier process, keeping their expiry."""
+		restored = 0
+		for user_id, stripe_id, ttl in state["customer_ids"]:
+			if ttl - age > 0:
+				self.customer_ids.set(user_id, stripe_id, ttl=ttl - age)
+				restored += 1
+		return restored > 0
+
+	async def get_or_create_stripe_customer(self, user_id, stale_stripe_id: str = None):
+		stripe_id = self._cached_customer_id(user_id)
+		if stripe_id and stripe_id != stale_stripe_id:
+			return stripe_id
+
+		# Serialize first-time lookups per user so concurrent requests cannot create duplicate customers
+		async with self._customer_locks.lock(user_id):
+			stripe_id = self._cached_customer_id(user_id)
+			if stripe_id and stripe_id != stale_stripe_id:
+				return stripe_id
+			return await self._get_or_create_stripe_customer(user_id, stale_stripe_id=stale_stripe_id)
+
+	async def _get_or_create_stripe_customer(self, user_id, stale_stripe_id: str = None):
 		# Get user info from Auth0
 		try:
-			user_info = self.auth0_manager.get_user_info(user_id)
+			user_info = await self.auth0_manager.get_user_info(user_id)
+		except (CircuitOpenError, RateLimitExceeded):
+			raise
 		except Exception as e:
 			raise HTTPException(status_code=404, detail="User not found in Auth0.")
 
-		# Check if user already has a Stripe ID
-		app_metadata = user_info.get("app_metadata", {})
+		# Check if user already has a Stripe ID; one still waiting in the outbox is newer than Auth0's copy
+		app_metadata = {**user_info.get("app_metadata", {}), **(self.metadata_outbox.pending(user_id) or {})}
 		stripe_id = app_metadata.get("stripe_id", None)
 
-		if stripe_id:
-			print(f"User already has a Stripe ID: {stripe_id}")
+		if stripe_id and stripe_id != stale_stripe_id:
+			logger.debug("User %s already has Stripe ID %s", user_id, stripe_id)
+			self._remember_customer_id(user_id, stripe_id)
 			return stripe_id
 
 		# Create a new Stripe customer
 		try:
-			customer = stripe.Customer.create(
+			customer = await stripe_executor.run(
+				stripe.Customer.create,
 				email=user_info.get("email"),
 				name=f'{user_info.get("given_name")} {user_info.get("family_name")}',
+				metadata={"auth0_sub": user_id},
+				# A retry of a failed request gets the same customer back instead of a duplicate
+				idempotency_key=idempotency_key("customer", user_id, stale_stripe_id),
 			)
 			stripe_id = customer["id"]
+			self._remember_customer_id(user_id, stripe_id)
 		except StripeError as e:
-			logger.error(f"Failed to create Stripe customer: {e}")
+			logger.error("Failed to create Stripe customer: %s", e)
 			raise HTTPException(status_code=400, detail=f"Stripe error: {e.user_message}")
 
-		# Update Auth0 app_metadata with the new Stripe ID
-		app_metadata["stripe_id"] = stripe_id
-		updated_user = self.auth0_manager.update_user_metadata(user_id, app_metadata=app_metadata)
-		if updated_user:
-			print(f"Successfully updated user metadata with Stripe ID: {stripe_id}")
-			return stripe_id
-		else:
-			print("Failed to update user metadata with Stripe ID.")
-			return None
+		# The local mapping already answers for this user; Auth0 gets the new Stripe ID from the outbox
+		self.metadata_outbox.enqueue(user_id, {"stripe_id": stripe_id})
+		logger.info("Created Stripe customer %s for %s", stripe_id, user_id)
+		return stripe_id
 
-	def get_stripe_customer(self, user_id: str = None, stripe_id: str = None):
-		if stripe_id is None:
-			stripe_id = self.get_or_create_stripe_customer(user_id)
-		elif stripe_id is None and user_id is None:
+	async def get_stripe_customer_id(self, user_id: str = None, stripe_id: str = None) -> Optional[str]:
+		if stripe_id is not None:
+			return stripe_id
+		if user_id is None:
 			raise ValueError(f"Must provide either user_id or stripe_id.")
+		return await self.get_or_create_stripe_customer(user_id)
+
+	async def get_stripe_customer(self, user_id: str = None, stripe_id: str = None):
+		stripe_id = await self.get_stripe_customer_id(user_id=user_id, stripe_id=stripe_id)
 
 		try:
-			customer = stripe.Customer.retrieve(stripe_id)
+			customer = await stripe_executor.run(stripe.Customer.retrieve, stripe_id)
 			return customer
 		except Exception as e:
-			print(f"Failed to retrieve Stripe customer: {e}")
+			logger.error("Failed to retrieve Stripe customer: %s", e)
 			return None
 
-	def get_portal_link(self, user_id: str = None, stripe_id: str = None) -> str:
-		stripe_customer = self.get_stripe_customer(user_id=user_id, stripe_id=stripe_id)
+	async def _with_customer(self, call, user_id: str = None, stripe_id: str = None):
+		"""
+		Run `call(customer_id)`; if Stripe no longer knows a mapped customer, drop the mapping and retry once.
+		"""
+		customer_id = await self.get_stripe_customer_id(user_id=user_id, stripe_id=stripe_id)
+		if customer_id is None:
+			raise HTTPException(status_code=404, detail="Stripe customer not found.")
+		try:
+			return await call(customer_id)
+		except stripe.error.InvalidRequestError as e:
+			if stripe_id is not None or e.code != 'resource_missing' or e.param != 'customer':
+				raise
+		logger.warning("Stripe customer %s of %s no longer exists, resolving it again", customer_id, user_id)
+		upstream_retries.inc("stripe", "customer")
+		self.forget_customer_id(user_id)
+		return await call(await self.get_or_create_stripe_customer(user_id, stale_stripe_id=customer_id))
 
-		session = stripe.billing_portal.Session.create(
-			customer=stripe_customer.get('id'),
-		)
-		return session.get('url')
+	async def get_portal_link(self, user_id: str = None, stripe_id: str = None) -> str:
+		# A repeat open within the reuse window costs no upstream call; concurrent ones share one creation
+		key = user_id or stripe_id
+		url = self.portal_links.get(key)
+		if url is not None:
+			return url
+		return await self._portal_single_flight.do(key, self._create_portal_link, key, user_id, stripe_id)
 
-	def create_stripe_checkout_session(
+	async def _create_portal_link(self, key: str, user_id: str = None, stripe_id: str = None) -> str:
+		async def create_portal_session(customer_id):
+			return await stripe_executor.run(stripe.billing_portal.Session.create, customer=customer_id)
+
+		session = await self._with_customer(create_portal_session, user_id=user_id, stripe_id=stripe_id)
+		url = session.get('url')
+		if url:
+			self.portal_links.set(key, url)
+		return url
+
+	async def create_stripe_checkout_session(
 			self, price_id, success_url, cancel_url, user_id: str = None,
 			stripe_id: str = None
 	) -> str:
-		stripe_customer = self.get_stripe_customer(user_id=user_id, stripe_id=stripe_id)
-		if stripe_customer is None:
-			raise HTTPException(status_code=404, detail="Stripe customer not found.")
+		# Repeated requests for the same user and price share one session
+		key = (user_id or stripe_id, price_id, success_url, cancel_url)
 
-		try:
-			session = stripe.checkout.Session.create(
-				customer=stripe_customer.get('id'),
+		async def create_checkout_session(customer_id):
+			return await stripe_executor.run(
+				stripe.checkout.Session.create,
+				customer=customer_id,
 				success_url=success_url,
 				cancel_url=cancel_url,
 				mode='subscription',
@@ -88,50 +211,85 @@ class StripeWithAuth0:
 					'price': price_id,
 					'quantity': 1
 				}],
+				idempotency_key=checkout_sessions.idempotency_key(key, customer_id, price_id, success_url, cancel_url),
 			)
+
+		async def create():
+			return await self._with_customer(create_checkout_session, user_id=user_id, stripe_id=stripe_id)
+
+		try:
+			session = await checkout_sessions.get_or_create(key, create)
 			return session.get('url')
 		except stripe.error.StripeError as e:
-			logger.error(f"Failed to create Stripe checkout session: {e}")
+			logger.error("Failed to create Stripe checkout session: %s", e)
 			raise HTTPException(status_code=400, detail=f"Stripe error: {e.user_message}")
 
-	def check_subscription_status(self, user_id: str = None, stripe_id: str = None) -> Optional[str]:
-		stripe_customer = self.get_stripe_customer(user_id=user_id, stripe_id=stripe_id)
-		if not stripe_customer:
-			print("Failed to retrieve Stripe customer.")
+	@staticmethod
+	def _list_subscriptions(stripe_customer_id: str) -> List:
+		subscriptions = stripe.Subscription.list(customer=stripe_customer_id, status='all', limit=100)
+		return list(subscriptions.auto_paging_iter())
+
+	async def sync_subscriptions(self, stripe_customer_id: str) -> bool:
+		"""
+		Copy every subscription of the customer from Stripe into the store. Returns whether one is active.
+		"""
+		has_active_subscription = False
+		subscriptions = await stripe_executor.run(self._list_subscriptions, stripe_customer_id)
+		for subscription in subscriptions:
+			# Backfill the store; event_created=0 lets any webhook event take precedence
+			subscription_store.upsert_subscription(subscription, event_created=0)
+			has_active_subscription = has_active_subscription or subscription.status == 'active'
+		subscription_store.mark_synced(stripe_customer_id)
+		return has_active_subscription
+
+	async def check_subscription_status(self, user_id: str = None, stripe_id: str = None) -> Optional[str]:
+		stripe_customer_id = await self.get_stripe_customer_id(user_id=user_id, stripe_id=stripe_id)
+		if not stripe_customer_id:
 			return None
 
-		stripe_customer_id = stripe_customer.get('id')
+		# Served locally once the webhook keeps the store up to date
+		if settings.STRIPE_WEBHOOK_SECRET:
+			status = subscription_store.get_subscription_status(stripe_customer_id)
+			if status is not None:
+				return status
 
 		try:
-			subscriptions = stripe.Subscription.list(customer=stripe_customer_id, status='active')
-			if subscriptions.data:
+			if await self.sync_subscriptions(stripe_customer_id):
 				# Customer has at least one active subscription
 				return 'Active'
 			else:
 				# Customer has no active subscriptions
 				return 'Inactive'
+		except CircuitOpenError:
+			# Stripe is down: answer from what the store last saw
+			return subscription_store.get_subscription_status(stripe_customer_id)
 		except Exception as e:
-			print(f"Failed to check subscription status: {e}")
+			logger.error("Failed to check subscription status: %s", e)
 			return None
 
-	def check_payment_status(self, user_id: str = None, stripe_id: str = None) -> Optional[str]:
-		stripe_customer = self.get_stripe_customer(user_id=user_id, stripe_id=stripe_id)
-		if not stripe_customer:
-			print("Failed to retrieve Stripe customer.")
+	async def check_payment_status(self, user_id: str = None, stripe_id: str = None) -> Optional[str]:
+		stripe_customer_id = await self.get_stripe_customer_id(user_id=user_id, stripe_id=stripe_id)
+		if not stripe_customer_id:
 			return None
 
-		stripe_customer_id = stripe_customer.get('id')
+		if settings.STRIPE_WEBHOOK_SECRET:
+			status = subscription_store.get_payment_status(stripe_customer_id)
+			if status is not None:
+				return status
 
 		try:
-			latest_invoice = stripe.Invoice.list(customer=stripe_customer_id, limit=1).data[0]
+			latest_invoice = (await stripe_executor.run(stripe.Invoice.list, customer=stripe_customer_id, limit=1)).data[0]
+			subscription_store.upsert_invoice(latest_invoice)
 			if latest_invoice.status == 'paid':
 				# The latest invoice is paid
 				return 'Paid'
 			else:
 				# The latest invoice is not paid
 				return 'Unpaid'
+		except CircuitOpenError:
+			return subscription_store.get_payment_status(stripe_customer_id)
 		except Exception as e:
-			print(f"Failed to check invoice status: {e}")
+			logger.error("Failed to check invoice status: %s", e)
 			return None
 
 
@@ -147,36 +305,46 @@ class StripeProductPriceFetcher:
 		}
 		return metadata
 
-	def fetch_products_and_prices(self) -> List[Dict[str, object]]:
-		product_price_list = []
-
-		products = stripe.Product.list(limit=100)  # Adjust limit as needed
-		for product in products:
-			deserialized_metadata = self.deserialize_metadata(product.metadata) if product.metadata else None
-
-			product_info = {
-				"product_id": product.id,
-				"product_name": product.name,
-				"description": product.description,  # Include description
-				"active": product.active,  # Include active status
-				"images": product.images,  # Include images
-				"metadata": deserialized_metadata,  # Deserialize metadata
-				"prices": []
-			}
-
-			prices = stripe.Price.list(product=product.id, limit=100)  # Adjust limit as needed
-			for price in prices:
-				price_deserialized_metadata = self.deserialize_metadata(price.metadata) if price.metadata else None
-
-				price_info = {
-					"price_id": price.id,
-					"currency": price.currency,
-					"unit_amount": price.unit_amount,
-					"recurring_interval": price.recurring.interval if price.recurring else None,
-					"metadata": price_deserialized_metadata  # Deserialize metadata
-				}
-				product_info["prices"].append(price_info)
-
-			product_price_list.append(product_info)
-
-		return product_price_list
+	def product_info(self, product) -> Dict[str, object]:
+		return {
+			"product_id": product.id,
+			"product_name": product.name,
+			"description": product.description,  # Include description
+			"active": product.active,  # Include active status
+			"images": product.images,  # Include images
+			"metadata": self.deserialize_metadata(product.metadata) if product.metadata else None,
+			"prices": []
+		}
+
+	def price_info(self, price) -> Dict[str, object]:
+		return {
+			"price_id": price.id,
+			"currency": price.currency,
+			"unit_amount": price.unit_amount,
+			"recurring_interval": price.recurring.interval if price.recurring else None,
+			"metadata": self.deserialize_metadata(price.metadata) if price.metadata else None
+		}
+
+	def fetch_products_and_prices(self, active_only: bool = True) -> List[Dict[str, object]]:
+		"""
+		List every price with its product expanded and group them by product.
+
+		The whole catalog comes from a single auto-paginated Price.list, so the number of upstream
+		calls depends only on the number of pages, not on the number of products.
+		"""
+		products: Dict[str, Dict[str, object]] = {}
+
+		list_params = {"expand": ["data.product"], "limit": 100}
+		if active_only:
+			list_params["active"] = True
+
+		for price in stripe.Price.list(**list_params).auto_paging_iter():
+			product = price.product
+			if getattr(product, "deleted", False) or (active_only and not product.active):
+				continue
+
+			if product.id not in products:
+				products[product.id] = self.product_info(product)
+			products[product.id]["prices"].append(self.price_info(price))
+
+		return list(products.values())
@@ -0,0 +1,99 @@
+import math
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from src.core.config import settings
+from src.helpers.catalog import catalog_cache
+from src.helpers.store import SubscriptionStore, subscription_store
+
+
+class SubscriptionTier(NamedTuple):
+	product_id: str
+	name: str
+	request_limit: Optional[int]  # None means unlimited
+
+
+class QuotaDecision(NamedTuple):
+	allowed: bool
+	limit: int
+	remaining: int
+	retry_after: int  # seconds until a request would be allowed again, 0 when allowed
+
+
+class MemoryUsageBackend:
+	"""Per-process window counters."""
+
+	def __init__(self):
+		self._counts: Dict[str, Tuple[int, int, int]] = {}  # key -> (window_index, previous, current)
+		self._lock = threading.Lock()
+
+	def add_usage(self, quota_key: str, window_index: int, delta: int = 1) -> Tuple[int, int]:
+		with self._lock:
+			stored_index, previous, current = self._counts.get(quota_key, (window_index, 0, 0))
+			if stored_index == window_index - 1:
+				previous, current = current, 0
+			elif stored_index != window_index:
+				previous, current = 0, 0
+			current += delta
+			self._counts[quota_key] = (window_index, previous, current)
+			return previous, current
+
+
+class SlidingWindowLimiter:
+	"""
+	Sliding-window request counter with O(1) state per key.
+
+	The count of the previous fixed window is weighted by how much of it still overlaps the sliding window,
+	which approximates a true sliding log without keeping one timestamp per request. Counters live in
+	memory, or in the local SQLite store when several worker processes must share them.
+	"""
+
+	def __init__(self, window: int, backend=None):
+		self.window = window
+		self.backend = backend or MemoryUsageBackend()
+
+	def hit(self, quota_key: str, limit: int) -> QuotaDecision:
+		now = time.time()
+		window_index = int(now // self.window)
+		elapsed = (now % self.window) / self.window
+
+		previous, current = self.backend.add_usage(quota_key, window_index)
+		used = previous * (1 - elapsed) + current
+		if used <= limit:
+			return QuotaDecision(True, limit, int(limit - used), 0)
+
+		# Over the limit: give the request back and tell the caller when the oldest requests age out
+		self.backend.add_usage(quota_key, window_index, delta=-1)
+		retry_after = (1 - elapsed) * self.window
+		if previous:
+			retry_after = min(retry_after, (used - limit) / previous * self.window)
+		return QuotaDecision(False, limit, 0, max(1, math.ceil(retry_after)))
+
+
+async def resolve_subscription_tier(auth0_sub: str, store: SubscriptionStore = subscription_store) -> Optional[SubscriptionTier]:
+	"""
+	Resolve the caller's tier from the local subscription store and the cached catalog, without calling Stripe.
+	"""
+	customer_id = store.get_customer_id(auth0_sub)
+	if customer_id is None:
+		return None
+
+	subscription = store.get_active_subscription(customer_id)
+	if subscription is None:
+		return None
+
+	product = await catalog_cache.get_product(subscription["product_id"]) or {}
+	limits = (product.get("metadata") or {}).get("limits") or {}
+	request_limit = limits.get("requests") if isinstance(limits, dict) else None
+	return SubscriptionTier(
+		product_id=subscription["product_id"],
+		name=product.get("product_name", subscription["product_id"]),
+		request_limit=int(request_limit) if request_limit is not None else None,
+	)
+
+
+quota_limiter = SlidingWindowLimiter(
+	window=settings.QUOTA_WINDOW_SECONDS,
+	backend=subscription_store if settings.QUOTA_SHARED_STORE else None,
+)
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from typing import Mapping, Optional
+
+from src.core.config import logger
+from src.core.metrics import metrics
+
+governor_rate = metrics.gauge(
+	"robofast_rate_governor_rate", "Requests per second a rate governor currently lets through.", ("upstream",)
+)
+governor_wait = metrics.histogram(
+	"robofast_rate_governor_wait_seconds", "Time calls were queued by a rate governor.", ("upstream",)
+)
+
+# Never slow down below this, even when the upstream reports almost no remaining requests
+MIN_RATE = 0.1  # requests per second
+
+
+class RateLimitExceeded(Exception):
+	"""
+	Raised instead of queueing a call longer than the governor's `max_wait`. Nothing was sent: unlike
+	CircuitOpenError it says nothing about the upstream's health, only that our own pace is used up.
+	"""
+
+	def __init__(self, upstream: str, retry_after: float):
+		super().__init__(f"{upstream} rate limit reached, retry in {retry_after:.0f}s")
+		self.upstream = upstream
+		self.retry_after = retry_after
+
+
+class RateGovernor:
+	"""
+	Token bucket pacing the calls to one rate-limited upstream.
+
+	Calls reserve their slot in arrival order: up to `burst` go through immediately, the rest are spaced
+	`1 / rate` seconds apart. A call that would have to wait more than `max_wait` seconds fails at once with
+	RateLimitExceeded. `observe` adapts the pace to the X-RateLimit-* headers of the upstream's responses,
+	and `pause_until_reset` holds every call back until the upstream's limit resets after a 429.
+	"""
+
+	def __init__(self, name: str, rate: float, burst: int, max_wait: float):
+		self.name = name
+		self.configured_rate = rate
+		self.rate = rate
+		self.burst = max(burst, 1)
+		self.max_wait = max_wait
+		# Time at which the bucket would be empty again if no more calls arrived
+		self._theoretical_arrival = 0.0
+		governor_rate.set_function(lambda: self.rate, name)
+
+	async def acquire(self):
+		now = time.monotonic()
+		interval = 1 / self.rate
+		arrival = max(self._theoretical_arrival, now)
+		wait = max(arrival - (self.burst - 1) * interval - now, 0)
+		if wait > self.max_wait:
+			raise RateLimitExceeded(self.name, wait)
+		self._theoretical_arrival = arrival + interval
+		governor_wait.observe(wait, self.name)
+		if wait > 0:
+			await asyncio.sleep(wait)
+
+	def pause_until(self, resume_at: float):
+		"""Let no call through before the monotonic time `resume_at`."""
+		self._theoretical_arrival = max(self._theoretical_arrival, resume_at + (self.burst - 1) / self.rate)
+
+	@staticmethod
+	def reset_delay(headers: Mapping[str, str]) -> Optional[float]:
+		"""Seconds until the upstream's limit resets, from X-RateLimit-Reset (epoch seconds) or Retry-After."""
+		try:
+			if "x-ratelimit-reset" in headers:
+				return max(float(headers["x-ratelimit-reset"]) - time.time(), 0)
+			if "retry-after" in headers:
+				return max(float(headers["retry-after"]), 0)
+		except ValueError:
+			pass
+		return None
+
+	def observe(self, headers: Mapping[str, str]):
+		"""Adapt the rate to the remaining requests the upstream reports for its current window."""
+		try:
+			remaining = int(headers["x-ratelimit-remaining"])
+		except (KeyError, ValueError):
+			return
+		reset_delay = self.reset_delay(headers)
+		if remaining <= 0 and reset_delay:
+			self.pause_until(time.monotonic() + reset_delay)
+		elif remaining < self.burst and reset_delay:
+			# Spread what is left over the rest of the window
+			self.rate = max(min(self.configured_rate, remaining / reset_delay), MIN_RATE)
+		else:
+			self.rate = self.configured_rate
+
+	def pause_until_reset(self, headers: Mapping[str, str], default: float) -> float:
+		"""Hold calls back after a 429 until the advertised reset; returns the pause in seconds."""
+		delay = self.reset_delay(headers)
+		delay = default if delay is None else delay
+		self.pause_until(time.monotonic() + delay)
+		logger.warning("%s rate limit reached, pausing calls for %.1fs", self.name, delay)
+		return delay
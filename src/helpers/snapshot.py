@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import struct
+import tempfile
+import time
+import zlib
+from typing import Any, Dict, Optional, Protocol, Tuple
+
+from src.core.config import settings, logger
+
+MAGIC = b"RFSNAP"
+VERSION = 1
+# magic, format version, wall-clock time the snapshot was taken
+HEADER = struct.Struct(">6sHd")
+
+
+class SnapshotError(Exception):
+	"""Raised for a snapshot file that is truncated, corrupt or of another format version."""
+
+
+class Snapshottable(Protocol):
+	def export_state(self) -> Optional[Dict[str, Any]]:
+		...
+
+	def restore_state(self, state: Dict[str, Any], age: float) -> bool:
+		...
+
+
+def encode_snapshot(sections: Dict[str, Any], created_at: float) -> bytes:
+	payload = json.dumps(sections, separators=(",", ":")).encode()
+	return HEADER.pack(MAGIC, VERSION, created_at) + zlib.compress(payload, 6)
+
+
+def decode_snapshot(data: bytes) -> Tuple[Dict[str, Any], float]:
+	if len(data) < HEADER.size:
+		raise SnapshotError("File is shorter than the snapshot header")
+	magic, version, created_at = HEADER.unpack_from(data)
+	if magic != MAGIC:
+		raise SnapshotError("Not a snapshot file")
+	if version != VERSION:
+		raise SnapshotError(f"Snapshot format version {version} is not supported (expected {VERSION})")
+	try:
+		# zlib verifies its own checksum, so truncation or corruption ends up here
+		sections = json.loads(zlib.decompress(data[HEADER.size:]))
+	except (zlib.error, ValueError) as e:
+		raise SnapshotError(f"Corrupt snapshot payload: {e}")
+	return sections, created_at
+
+
+class WarmStartSnapshot:
+	"""
+	Saves the warm caches of the process to `path` and loads them into the next process at startup.
+
+	Each registered component exports a JSON-serializable state and decides on restore, given the snapshot's
+	age, whether that state is still within its TTL. The file is a small header (magic, format version,
+	creation time) followed by the zlib-compressed JSON of every section, and is replaced atomically.
+	"""
+
+	def __init__(self, path: Optional[str], interval: float):
+		self.path = path
+		self.interval = interval
+		self.components: Dict[str, Snapshottable] = {}
+		self._save_task: Optional[asyncio.Task] = None
+
+	def register(self, name: str, component: Snapshottable):
+		self.components[name] = component
+
+	@property
+	def enabled(self) -> bool:
+		return bool(self.path)
+
+	def collect(self) -> Dict[str, Any]:
+		sections = {}
+		for name, component in self.components.items():
+			state = component.export_state()
+			if state is not None:
+				sections[name] = state
+		return sections
+
+	def write(self, sections: Dict[str, Any]) -> int:
+		"""Atomically replace the snapshot file and return its size in bytes."""
+		data = encode_snapshot(sections, created_at=time.time())
+
+		directory = os.path.dirname(os.path.abspath(self.path))
+		descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+		try:
+			with os.fdopen(descriptor, "wb") as file:
+				file.write(data)
+				file.flush()
+				os.fsync(file.fileno())
+			os.replace(temporary_path, self.path)
+		except BaseException:
+			os.unlink(temporary_path)
+			raise
+		return len(data)
+
+	def restore(self) -> Dict[str, bool]:
+		"""Load the snapshot, if any, into the registered components. Returns which sections were restored."""
+		if not self.enabled:
+			return {}
+		try:
+			with open(self.path, "rb") as file:
+				sections, created_at = decode_snapshot(file.read())
+		except FileNotFoundError:
+			return {}
+		except (OSError, SnapshotError) as e:
+			logger.warning("Ignoring warm-start snapshot %s: %s", self.path, e)
+			return {}
+
+		age = max(time.time() - created_at, 0)
+		restored = {}
+		for name, component in self.components.items():
+			if name not in sections:
+				continue
+			try:
+				restored[name] = component.restore_state(sections[name], age)
+			except (KeyError, TypeError, ValueError) as e:
+				logger.warning("Ignoring the %s section of the warm-start snapshot: %s", name, e)
+				restored[name] = False
+		logger.info("Warm-start snapshot from %.0fs ago restored: %s", age, restored)
+		return restored
+
+	async def save_quietly(self):
+		try:
+			# States are collected on the event loop, the file is written by a worker thread
+			size = await asyncio.to_thread(self.write, self.collect())
+			logger.debug("Warm-start snapshot written to %s (%d bytes)", self.path, size)
+		except Exception as e:
+			logger.warning("Writing the warm-start snapshot to %s failed: %s", self.path, e)
+
+	def start(self):
+		if self.enabled and self._save_task is None and self.interval > 0:
+			self._save_task = asyncio.get_running_loop().create_task(self._save_loop())
+
+	async def _save_loop(self):
+		while True:
+			await asyncio.sleep(self.interval)
+			await self.save_quietly()
+
+	async def stop(self):
+		"""Stop the periodic saves and write a last snapshot."""
+		if self._save_task is not None:
+			self._save_task.cancel()
+			self._save_task = None
+		if self.enabled:
+			await self.save_quietly()
+
+
+warm_start_snapshot = WarmStartSnapshot(path=settings.SNAPSHOT_PATH, interval=settings.SNAPSHOT_INTERVAL)
@@ -0,0 +1,319 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.core.config import settings
+
+ACTIVE_SUBSCRIPTION_STATUSES = ("active",)
+
+
+class SubscriptionStore:
+	"""
+	Local SQLite copy of the Stripe subscription state, kept up to date by the Stripe webhook.
+
+	Customers are keyed by both their Stripe customer id and the Auth0 `sub` they belong to, so
+	"is this user paying?" is answered with primary-key lookups instead of Stripe API calls.
+	Rows only move forward: an event older than the stored one is ignored.
+	"""
+
+	SCHEMA = """
+		CREATE TABLE IF NOT EXISTS customers (
+			customer_id TEXT PRIMARY KEY,
+			auth0_sub TEXT UNIQUE,
+			synced INTEGER NOT NULL DEFAULT 0,
+			updated_at REAL NOT NULL
+		);
+		CREATE TABLE IF NOT EXISTS subscriptions (
+			subscription_id TEXT PRIMARY KEY,
+			customer_id TEXT NOT NULL,
+			status TEXT NOT NULL,
+			price_id TEXT,
+			product_id TEXT,
+			current_period_start INTEGER,
+			current_period_end INTEGER,
+			event_created INTEGER NOT NULL
+		);
+		CREATE INDEX IF NOT EXISTS subscriptions_by_customer ON subscriptions (customer_id);
+		CREATE TABLE IF NOT EXISTS quota_usage (
+			quota_key TEXT NOT NULL,
+			window_index INTEGER NOT NULL,
+			count INTEGER NOT NULL,
+			PRIMARY KEY (quota_key, window_index)
+		);
+		CREATE TABLE IF NOT EXISTS invoices (
+			customer_id TEXT PRIMARY KEY,
+			invoice_id TEXT NOT NULL,
+			status TEXT,
+			invoice_created INTEGER NOT NULL
+		);
+		CREATE TABLE IF NOT EXISTS auth0_outbox (
+			auth0_sub TEXT PRIMARY KEY,
+			app_metadata TEXT NOT NULL,
+			attempts INTEGER NOT NULL DEFAULT 0,
+			next_attempt_at REAL NOT NULL,
+			last_error TEXT,
+			created_at REAL NOT NULL
+		);
+		CREATE INDEX IF NOT EXISTS auth0_outbox_by_next_attempt ON auth0_outbox (next_attempt_at);
+	"""
+
+	def __init__(self, path: str):
+		self.path = path
+		self._connection: Optional[sqlite3.Connection] = None
+		self._lock = threading.Lock()
+
+	@property
+	def connection(self) -> sqlite3.Connection:
+		if self._connection is None:
+			connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+			connection.row_factory = sqlite3.Row
+			connection.execute("PRAGMA journal_mode=WAL")
+			connection.execute("PRAGMA synchronous=NORMAL")
+			connection.executescript(self.SCHEMA)
+			self._connection = connection
+		return self._connection
+
+	def _execute(self, query: str, parameters=()) -> sqlite3.Cursor:
+		with self._lock:
+			return self.connection.execute(query, parameters)
+
+	def _fetchone(self, query: str, parameters=()) -> Optional[sqlite3.Row]:
+		with self._lock:
+			return self.connection.execute(query, parameters).fetchone()
+
+	# Customers
+
+	def set_customer(self, customer_id: str, auth0_sub: Optional[str] = None):
+		with self._lock:
+			if auth0_sub is not None:
+				# A sub belongs to a single customer; forget any previous mapping
+				self.connection.execute(
+					"UPDATE customers SET auth0_sub = NULL WHERE auth0_sub = ? AND customer_id != ?",
+					(auth0_sub, customer_id)
+				)
+			self.connection.execute(
+				"INSERT INTO customers (customer_id, auth0_sub, updated_at) VALUES (?, ?, ?) "
+				"ON CONFLICT (customer_id) DO UPDATE SET "
+				"auth0_sub = COALESCE(excluded.auth0_sub, customers.auth0_sub), updated_at = excluded.updated_at",
+				(customer_id, auth0_sub, time.time())
+			)
+
+	def import_customers(self, mappings: Iterable[Tuple[str, str]]) -> int:
+		"""
+		Bulk-load (customer_id, auth0_sub) pairs in one transaction and return how many were written.
+
+		Users with an app_metadata update still in the outbox are skipped: their local mapping is newer.
+		"""
+		mappings = list(mappings)
+		if not mappings:
+			return 0
+		now = time.time()
+		with self._lock:
+			connection = self.connection
+			placeholders = ", ".join("?" for _ in mappings)
+			pending = {
+				row["auth0_sub"] for row in connection.execute(
+					f"SELECT auth0_sub FROM auth0_outbox WHERE auth0_sub IN ({placeholders})",
+					[auth0_sub for _, auth0_sub in mappings]
+				)
+			}
+			rows = [(customer_id, auth0_sub) for customer_id, auth0_sub in mappings if auth0_sub not in pending]
+			connection.execute("BEGIN")
+			try:
+				for customer_id, auth0_sub in rows:
+					# Same statements as set_customer, without a commit per row
+					connection.execute(
+						"UPDATE customers SET auth0_sub = NULL WHERE auth0_sub = ? AND customer_id != ?",
+						(auth0_sub, customer_id)
+					)
+					connection.execute(
+						"INSERT INTO customers (customer_id, auth0_sub, updated_at) VALUES (?, ?, ?) "
+						"ON CONFLICT (customer_id) DO UPDATE SET auth0_sub = excluded.auth0_sub, "
+						"updated_at = excluded.updated_at",
+						(customer_id, auth0_sub, now)
+					)
+				connection.execute("COMMIT")
+			except BaseException:
+				connection.execute("ROLLBACK")
+				raise
+		return len(rows)
+
+	def delete_customer(self, customer_id: str):
+		with self._lock:
+			self.connection.execute("DELETE FROM customers WHERE customer_id = ?", (customer_id,))
+			self.connection.execute("DELETE FROM subscriptions WHERE customer_id = ?", (customer_id,))
+			self.connection.execute("DELETE FROM invoices WHERE customer_id = ?", (customer_id,))
+
+	def get_customer_id(self, auth0_sub: str, max_age: Optional[float] = None) -> Optional[str]:
+		"""
+		Return the Stripe customer id of the user; with `max_age`, only a mapping written within that many seconds.
+		"""
+		row = self._fetchone("SELECT customer_id, updated_at FROM customers WHERE auth0_sub = ?", (auth0_sub,))
+		if row is None or (max_age is not None and time.time() - row["updated_at"] > max_age):
+			return None
+		return row["customer_id"]
+
+	def forget_auth0_sub(self, auth0_sub: str):
+		self._execute("UPDATE customers SET auth0_sub = NULL WHERE auth0_sub = ?", (auth0_sub,))
+
+	def get_auth0_sub(self, customer_id: str) -> Optional[str]:
+		row = self._fetchone("SELECT auth0_sub FROM customers WHERE customer_id = ?", (customer_id,))
+		return row["auth0_sub"] if row else None
+
+	def mark_synced(self, customer_id: str):
+		"""
+		Record that every subscription of the customer is in the store, making it authoritative for them.
+		"""
+		self.set_customer(customer_id)
+		# The sync time, so callers without the webhook can tell how stale the copy is
+		self._execute("UPDATE customers SET synced = ? WHERE customer_id = ?", (int(time.time()), customer_id))
+
+	def is_synced(self, customer_id: str, max_age: Optional[float] = None) -> bool:
+		"""
+		Whether the customer's subscriptions were synced; with `max_age`, only a sync within that many seconds.
+		"""
+		row = self._fetchone("SELECT synced FROM customers WHERE customer_id = ?", (customer_id,))
+		if not (row and row["synced"]):
+			return False
+		return max_age is None or time.time() - row["synced"] <= max_age
+
+	# Subscriptions
+
+	def upsert_subscription(self, subscription: Dict, event_created: int):
+		items = subscription.get("items", {}).get("data", [])
+		price = items[0].get("price", {}) if items else {}
+		product = price.get("product")
+		self._execute(
+			"INSERT INTO subscriptions (subscription_id, customer_id, status, price_id, product_id, "
+			"current_period_start, current_period_end, event_created) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+			"ON CONFLICT (subscription_id) DO UPDATE SET status = excluded.status, price_id = excluded.price_id, "
+			"product_id = excluded.product_id, current_period_start = excluded.current_period_start, "
+			"current_period_end = excluded.current_period_end, event_created = excluded.event_created "
+			"WHERE excluded.event_created >= subscriptions.event_created",
+			(
+				subscription["id"],
+				subscription["customer"],
+				subscription["status"],
+				price.get("id"),
+				product.get("id") if isinstance(product, dict) else product,
+				subscription.get("current_period_start"),
+				subscription.get("current_period_end"),
+				event_created,
+			)
+		)
+
+	def get_active_subscription(self, customer_id: str) -> Optional[sqlite3.Row]:
+		placeholders = ", ".join("?" for _ in ACTIVE_SUBSCRIPTION_STATUSES)
+		return self._fetchone(
+			f"SELECT * FROM subscriptions WHERE customer_id = ? AND status IN ({placeholders}) "
+			"ORDER BY current_period_end DESC LIMIT 1",
+			(customer_id, *ACTIVE_SUBSCRIPTION_STATUSES)
+		)
+
+	def get_subscription_status(self, customer_id: str) -> Optional[str]:
+		"""
+		Return 'Active' or 'Inactive', or None when the store has not seen this customer's subscriptions.
+		"""
+		if self.get_active_subscription(customer_id) is not None:
+			return 'Active'
+		if self.is_synced(customer_id):
+			return 'Inactive'
+		return None
+
+	# Invoices
+
+	def upsert_invoice(self, invoice: Dict):
+		self._execute(
+			"INSERT INTO invoices (customer_id, invoice_id, status, invoice_created) VALUES (?, ?, ?, ?) "
+			"ON CONFLICT (customer_id) DO UPDATE SET invoice_id = excluded.invoice_id, status = excluded.status, "
+			"invoice_created = excluded.invoice_created "
+			"WHERE excluded.invoice_created >= invoices.invoice_created",
+			(invoice["customer"], invoice["id"], invoice.get("status"), invoice["created"])
+		)
+
+	def get_payment_status(self, customer_id: str) -> Optional[str]:
+		"""
+		Return 'Paid' or 'Unpaid' for the latest invoice, or None when no invoice is known.
+		"""
+		row = self._fetchone("SELECT status FROM invoices WHERE customer_id = ?", (customer_id,))
+		if row is None:
+			return None
+		return 'Paid' if row["status"] == 'paid' else 'Unpaid'
+
+	# Quota usage
+
+	def add_usage(self, quota_key: str, window_index: int, delta: int = 1) -> Tuple[int, int]:
+		"""
+		Add `delta` to the usage of the window and return the (previous, current) window counts.
+		"""
+		with self._lock:
+			self.connection.execute(
+				"INSERT INTO quota_usage (quota_key, window_index, count) VALUES (?, ?, ?) "
+				"ON CONFLICT (quota_key, window_index) DO UPDATE SET count = count + excluded.count",
+				(quota_key, window_index, delta)
+			)
+			rows = self.connection.execute(
+				"SELECT window_index, count FROM quota_usage WHERE quota_key = ? AND window_index >= ?",
+				(quota_key, window_index - 1)
+			).fetchall()
+			self.connection.execute(
+				"DELETE FROM quota_usage WHERE quota_key = ? AND window_index < ?", (quota_key, window_index - 1)
+			)
+		counts = {row["window_index"]: row["count"] for row in rows}
+		return counts.get(window_index - 1, 0), counts.get(window_index, 0)
+
+	# Auth0 app_metadata outbox
+
+	def enqueue_app_metadata(self, auth0_sub: str, app_metadata: Dict):
+		"""
+		Queue an app_metadata update for the user, merged into any update of theirs that is still pending.
+		"""
+		now = time.time()
+		with self._lock:
+			row = self.connection.execute(
+				"SELECT app_metadata FROM auth0_outbox WHERE auth0_sub = ?", (auth0_sub,)
+			).fetchone()
+			pending = json.loads(row["app_metadata"]) if row else {}
+			self.connection.execute(
+				"INSERT INTO auth0_outbox (auth0_sub, app_metadata, next_attempt_at, created_at) VALUES (?, ?, ?, ?) "
+				"ON CONFLICT (auth0_sub) DO UPDATE SET app_metadata = excluded.app_metadata, "
+				"next_attempt_at = excluded.next_attempt_at",
+				(auth0_sub, json.dumps({**pending, **app_metadata}, sort_keys=True), now, now)
+			)
+
+	def due_app_metadata(self, limit: int) -> List[sqlite3.Row]:
+		with self._lock:
+			return self.connection.execute(
+				"SELECT * FROM auth0_outbox WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+				(time.time(), limit)
+			).fetchall()
+
+	def complete_app_metadata(self, auth0_sub: str, app_metadata: str):
+		# An update merged in while this one was in flight stays queued
+		self._execute(
+			"DELETE FROM auth0_outbox WHERE auth0_sub = ? AND app_metadata = ?", (auth0_sub, app_metadata)
+		)
+
+	def retry_app_metadata(self, auth0_sub: str, error: str, delay: float):
+		self._execute(
+			"UPDATE auth0_outbox SET attempts = attempts + 1, last_error = ?, next_attempt_at = ? WHERE auth0_sub = ?",
+			(error, time.time() + delay, auth0_sub)
+		)
+
+	def pending_app_metadata(self, auth0_sub: str) -> Optional[Dict]:
+		row = self._fetchone("SELECT app_metadata FROM auth0_outbox WHERE auth0_sub = ?", (auth0_sub,))
+		return json.loads(row["app_metadata"]) if row else None
+
+	def app_metadata_outbox_stats(self) -> Dict[str, float]:
+		row = self._fetchone("SELECT COUNT(*) AS pending, MIN(created_at) AS oldest FROM auth0_outbox")
+		return {"pending": row["pending"], "oldest_age": round(time.time() - row["oldest"]) if row["oldest"] else 0}
+
+	def close(self):
+		if self._connection is not None:
+			self._connection.close()
+			self._connection = None
+
+
+subscription_store = SubscriptionStore(settings.LOCAL_STORE_PATH)
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import time
+import zlib
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from src.core.config import logger
+from src.helpers.authentication import Auth0RequestError, Auth0UserManagement
+from src.helpers.store import SubscriptionStore
+
+# The v3 search engine returns at most this many results per query, beyond it only an export reaches every user
+SEARCH_RESULT_LIMIT = 1000
+SEARCH_QUERY = "_exists_:app_metadata.stripe_id"
+EXPORT_FIELDS = [{"name": "user_id"}, {"name": "app_metadata.stripe_id", "export_as": "stripe_id"}]
+
+
+class UserImportResult(NamedTuple):
+	source: str
+	users_read: int
+	mappings_loaded: int
+	duration: float
+
+	def describe(self) -> str:
+		return (
+			f"Imported {self.mappings_loaded} Stripe customer mappings from {self.users_read} Auth0 users "
+			f"({self.source}, {self.duration:.1f}s)"
+		)
+
+
+def stripe_id_of(user: Dict) -> Optional[str]:
+	# Exported rows carry the field as `stripe_id`, searched users in their app_metadata
+	return user.get("stripe_id") or (user.get("app_metadata") or {}).get("stripe_id")
+
+
+async def ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict]:
+	"""Decode a possibly gzipped NDJSON byte stream one line at a time."""
+	decompressor = None
+	buffer = b""
+	async for chunk in chunks:
+		if decompressor is None:
+			# Export files are gzipped, 0x1f8b is the gzip magic number
+			gzipped = chunk[:2] == b"\x1f\x8b"
+			decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else False
+		buffer += decompressor.decompress(chunk) if decompressor else chunk
+		*lines, buffer = buffer.split(b"\n")
+		for line in lines:
+			if line.strip():
+				yield json.loads(line)
+	if decompressor:
+		buffer += decompressor.flush()
+	if buffer.strip():
+		yield json.loads(buffer)
+
+
+class Auth0UserImport:
+	"""
+	Loads the Stripe customer id of every Auth0 user that has one into the subscription store.
+
+	Users are read from the Management API user search while the tenant has at most SEARCH_RESULT_LIMIT of
+	them, and from a users export job otherwise. Both are streamed and written to SQLite `batch_size` users
+	at a time, so memory use does not grow with the number of users.
+	"""
+
+	EXPORT_POLL_INTERVAL = 2  # seconds between export job status checks
+	EXPORT_TIMEOUT = 900  # seconds to wait for an export job to complete
+
+	def __init__(self, store: SubscriptionStore, auth0_manager: Auth0UserManagement, batch_size: int = 500):
+		self.store = store
+		self.auth0_manager = auth0_manager
+		self.batch_size = batch_size
+		self._task: Optional[asyncio.Task] = None
+
+	async def _search(self, first_page: Dict, per_page: int) -> AsyncIterator[Dict]:
+		page, response = 0, first_page
+		while True:
+			for user in response.get("users", []):
+				yield user
+			page += 1
+			if page * per_page >= min(response.get("total", 0), SEARCH_RESULT_LIMIT):
+				return
+			response = await self.auth0_manager.search_users(
+				SEARCH_QUERY, fields="user_id,app_metadata", page=page, per_page=per_page
+			)
+
+	async def _export(self) -> AsyncIterator[Dict]:
+		job = await self.auth0_manager.create_users_export(EXPORT_FIELDS)
+		deadline = time.monotonic() + self.EXPORT_TIMEOUT
+		while job.get("status") != "completed":
+			if job.get("status") == "failed":
+				raise Auth0RequestError(f"Users export job {job['id']} failed")
+			if time.monotonic() > deadline:
+				raise Auth0RequestError(f"Users export job {job['id']} did not complete in {self.EXPORT_TIMEOUT}s")
+			await asyncio.sleep(self.EXPORT_POLL_INTERVAL)
+			job = await self.auth0_manager.get_job(job["id"])
+
+		# A pre-signed download URL: no management token, no rate limit
+		async with self.auth0_manager.client.stream("GET", job["location"]) as response:
+			response.raise_for_status()
+			async for user in ndjson_lines(response.aiter_bytes()):
+				yield user
+
+	async def _users(self, source: str) -> Tuple[str, AsyncIterator[Dict]]:
+		if source in ("auto", "search"):
+			per_page = 100
+			first_page = await self.auth0_manager.search_users(
+				SEARCH_QUERY, fields="user_id,app_metadata", page=0, per_page=per_page
+			)
+			if source == "search" or first_page.get("total", 0) <= SEARCH_RESULT_LIMIT:
+				return "search", self._search(first_page, per_page)
+		return "export", self._export()
+
+	async def run(self, source: str = "auto") -> UserImportResult:
+		"""Import the mappings; `source` is "search", "export" or "auto" to pick by the number of users."""
+		started = time.perf_counter()
+		source, users = await self._users(source)
+		users_read = mappings_loaded = 0
+		batch: List[Tuple[str, str]] = []
+		async for user in users:
+			users_read += 1
+			stripe_id = stripe_id_of(user)
+			if stripe_id and user.get("user_id"):
+				batch.append((stripe_id, user["user_id"]))
+			if len(batch) >= self.batch_size:
+				mappings_loaded += self.store.import_customers(batch)
+				batch = []
+		mappings_loaded += self.store.import_customers(batch)
+		return UserImportResult(source, users_read, mappings_loaded, time.perf_counter() - started)
+
+	def start(self, interval: float):
+		"""Run the import every `interval` seconds in the background, the first time right away."""
+		if self._task is None and interval > 0:
+			self._task = asyncio.get_running_loop().create_task(self._run_periodically(interval))
+
+	async def _run_periodically(self, interval: float):
+		while True:
+			try:
+				logger.info((await self.run()).describe())
+			except Exception as e:
+				logger.warning("Auth0 user import failed, retrying in %ss: %s", interval, e)
+			await asyncio.sleep(interval)
+
+	async def stop(self):
+		if self._task is not None:
+			self._task.cancel()
+			self._task = None
@@ -0,0 +1,36 @@
+from typing import Dict
+
+from src.core.config import logger
+from src.helpers.catalog import catalog_cache
+from src.helpers.checkout import checkout_sessions
+from src.helpers.store import subscription_store
+
+
+def handle_stripe_event(event: Dict) -> bool:
+	"""
+	Apply a verified Stripe event to the local state. Returns False for event types we do not consume.
+	"""
+	event_type = event["type"]
+	data = event["data"]["object"]
+
+	if event_type.startswith("customer.subscription."):
+		subscription_store.set_customer(data["customer"])
+		subscription_store.upsert_subscription(data, event_created=event["created"])
+	elif event_type.startswith("invoice."):
+		if data.get("customer"):
+			subscription_store.upsert_invoice(data)
+	elif event_type in ("customer.created", "customer.updated"):
+		subscription_store.set_customer(data["id"], auth0_sub=(data.get("metadata") or {}).get("auth0_sub"))
+	elif event_type == "customer.deleted":
+		subscription_store.delete_customer(data["id"])
+	elif event_type.startswith("checkout.session."):
+		# Completed or expired sessions must not be handed out again
+		checkout_sessions.forget_session(data["id"])
+	elif event_type.startswith(("product.", "price.")):
+		# The next catalog read refetches from Stripe
+		catalog_cache.invalidate()
+	else:
+		return False
+
+	logger.info("Applied Stripe event %s (%s)", event['id'], event_type)
+	return True
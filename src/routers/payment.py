@@ -1,8 +1,8 @@
 from fastapi import APIRouter
 
 from src.endpoints.payment import create_payment_link_func, checkout_success, checkout_failure, \
-	get_available_subscriptions_func, create_customer_portal_func
-from src.core.schema import SubscriptionsResponse, LinkResponse
+	get_available_subscriptions_func, create_customer_portal_func, stripe_webhook_func, get_subscription_usage_func
+from src.core.schema import SubscriptionsResponse, LinkResponse, SubscriptionUsageResponse
 
 payment_router = APIRouter(
 	prefix="/payment",
@@ -20,6 +20,21 @@ payment_router.add_api_route(
 	operation_id="subscriptions",
 )
 
+payment_router.add_api_route(
+	path="/usage",
+	endpoint=get_subscription_usage_func,
+	response_model=SubscriptionUsageResponse,
+	methods=["GET"],
+	summary="Return the user's subscription and remaining requests",
+	description="Subscribers only: the user's subscription, its request limit and the requests left in the current "
+	            "period. Answers 402 without an active subscription and 429 once the limit is used up.",
+	operation_id="subscription_usage",
+	responses={
+		402: {"description": "No active subscription, offer a payment link"},
+		429: {"description": "Request limit of the subscription used up, see Retry-After"},
+	}
+)
+
 payment_router.add_api_route(
 	path="/payment-link",
 	endpoint=create_payment_link_func,
@@ -83,3 +98,13 @@ payment_router.add_api_route(
 	operation_id="payment_failure",
 	include_in_schema=False
 )
+
+payment_router.add_api_route(
+	path="/webhook",
+	endpoint=stripe_webhook_func,
+	methods=["POST"],
+	summary='Stripe webhook',
+	description='Receive Stripe events that keep the local subscription state up to date',
+	operation_id="stripe_webhook",
+	include_in_schema=False
+)
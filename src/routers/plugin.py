@@ -1,6 +1,8 @@
 from fastapi import APIRouter
 
-from src.endpoints.plugin import ai_plugin_manifest, legal, healthcheck, home_page
+from src.core.config import settings
+from src.endpoints.plugin import ai_plugin_manifest, legal, healthcheck, home_page, openapi_json, openapi_yaml, \
+	api_docs, metrics_endpoint
 
 main_router = APIRouter()
 
@@ -36,3 +38,33 @@ main_router.add_api_route(
 	description='Show legal page',
 	operation_id="legal_page"
 )
+
+main_router.add_api_route(
+	path=f"/{settings.OPENAPI_PATH}",
+	endpoint=openapi_yaml,
+	methods=["GET"],
+	include_in_schema=False
+)
+
+main_router.add_api_route(
+	path=f"/{settings.OPENAPI_JSON_PATH}",
+	endpoint=openapi_json,
+	methods=["GET"],
+	include_in_schema=False
+)
+
+main_router.add_api_route(
+	path=f"/{settings.DOC_PATH}",
+	endpoint=api_docs,
+	methods=["GET"],
+	include_in_schema=False
+)
+
+main_router.add_api_route(
+	path="/metrics",
+	endpoint=metrics_endpoint,
+	methods=["GET"],
+	summary='Prometheus metrics',
+	description='Request and upstream call latencies in the Prometheus text format',
+	include_in_schema=False
+)
@@ -0,0 +1,17 @@
+import os
+import tempfile
+
+# Settings are read when src.core.config is imported: give the required ones test values
+os.environ.setdefault("APP_ENVIRONMENT", "test")
+os.environ.setdefault("APP_STATE_SECRET_KEY", "test")
+os.environ.setdefault("APP_AUTH0_DOMAIN", "example.auth0.com")
+os.environ.setdefault("APP_AUTH0_CLIENT_ID", "test")
+os.environ.setdefault("APP_AUTH0_CLIENT_SECRET", "test")
+os.environ.setdefault("APP_AUTH0_API_IDENTIFIER", "https://api.example.com")
+os.environ.setdefault("APP_AUTH0_MGM_CLIENT_ID", "test")
+os.environ.setdefault("APP_AUTH0_MGM_CLIENT_SECRET", "test")
+os.environ.setdefault("APP_STRIPE_SECRET_KEY", "sk_test")
+os.environ.setdefault("APP_CHATGPT_AUTH_TOKEN", "test")
+os.environ.setdefault("APP_LOG_LEVEL", "WARNING")
+os.environ["APP_SNAPSHOT_PATH"] = ""
+os.environ["APP_LOCAL_STORE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="robofast-tests-"), "store.sqlite3")
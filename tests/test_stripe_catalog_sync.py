@@ -0,0 +1,126 @@
+from types import SimpleNamespace
+
+import pytest
+
+from setup.stripe import StripeCatalogSync
+
+SUBSCRIPTIONS = [{
+	'name': 'Essential',
+	'description': 'Basic features.',
+	'code': 'essential',
+	'metadata': {'limits': {'requests': 100}},
+	'price': [{'price_id': 'essential_monthly', 'currency': 'usd', 'amount': 500, 'interval': 'month'}],
+}]
+PRODUCT_METADATA = {'limits': '{"requests": 100}', 'code': 'essential'}
+PRICE_METADATA = {'limits': '{"requests": 100}'}
+
+
+def product(id, metadata=None, name='Essential', active=True, created=0):
+	return SimpleNamespace(
+		id=id, name=name, description='Basic features.', metadata=metadata or {}, active=active, created=created
+	)
+
+
+def price(id, product_id, lookup_key=None, amount=500, interval='month', active=True):
+	return SimpleNamespace(
+		id=id, product=product_id, lookup_key=lookup_key, currency='usd', unit_amount=amount,
+		recurring=SimpleNamespace(interval=interval) if interval else None, metadata=dict(PRICE_METADATA), active=active,
+	)
+
+
+@pytest.fixture
+def catalog_sync():
+	return StripeCatalogSync(api_key='sk_test')
+
+
+def summary(changes):
+	return [(change.action, change.kind, change.stripe_id) for change in changes]
+
+
+def test_in_sync_catalog_is_a_no_op(catalog_sync):
+	products = [product('prod_1', dict(PRODUCT_METADATA))]
+	prices = [price('price_1', 'prod_1', 'essential_monthly')]
+
+	assert catalog_sync.plan(SUBSCRIPTIONS, products, prices) == []
+
+
+def test_adopts_uncoded_product_and_its_price(catalog_sync):
+	products = [product('prod_1', {'limits': '{"requests": 100}'})]
+	prices = [price('price_1', 'prod_1')]
+
+	changes = catalog_sync.plan(SUBSCRIPTIONS, products, prices)
+
+	assert summary(changes) == [('update', 'product', 'prod_1'), ('update', 'price', 'price_1')]
+	assert changes[0].params == {'metadata': {'code': 'essential'}}
+	assert changes[1].params == {'lookup_key': 'essential_monthly'}
+
+
+def test_changed_terms_replace_the_price(catalog_sync):
+	products = [product('prod_1', dict(PRODUCT_METADATA))]
+	prices = [price('price_1', 'prod_1', 'essential_monthly', amount=400)]
+
+	changes = catalog_sync.plan(SUBSCRIPTIONS, products, prices)
+
+	assert summary(changes) == [('create', 'price', None), ('archive', 'price', 'price_1')]
+	assert changes[0].params['transfer_lookup_key'] is True
+	assert changes[0].params['unit_amount'] == 500
+
+
+def test_archives_products_no_longer_listed(catalog_sync):
+	products = [product('prod_1', dict(PRODUCT_METADATA)), product('prod_2', {'code': 'legacy'}, name='Legacy')]
+	prices = [price('price_1', 'prod_1', 'essential_monthly'), price('price_2', 'prod_2', 'legacy_monthly')]
+
+	changes = catalog_sync.plan(SUBSCRIPTIONS, products, prices)
+
+	assert summary(changes) == [('archive', 'product', 'prod_2'), ('archive', 'price', 'price_2')]
+
+
+def test_archives_duplicate_uncoded_products(catalog_sync):
+	products = [
+		product('prod_new', created=200),
+		product('prod_old', created=100),
+		product('prod_inactive', active=False, created=50),
+	]
+	prices = [
+		price('price_new', 'prod_new'),
+		price('price_old', 'prod_old'),
+		price('price_inactive', 'prod_inactive', active=False),
+	]
+
+	changes = catalog_sync.plan(SUBSCRIPTIONS, products, prices)
+
+	# The oldest active product is adopted, the other active duplicate and its price archived
+	assert summary(changes) == [
+		('update', 'product', 'prod_old'),
+		('update', 'price', 'price_old'),
+		('archive', 'product', 'prod_new'),
+		('archive', 'price', 'price_new'),
+	]
+
+
+def test_archives_uncoded_duplicates_of_a_coded_product(catalog_sync):
+	products = [product('prod_1', dict(PRODUCT_METADATA)), product('prod_2')]
+	prices = [price('price_1', 'prod_1', 'essential_monthly'), price('price_2', 'prod_2')]
+
+	changes = catalog_sync.plan(SUBSCRIPTIONS, products, prices)
+
+	assert summary(changes) == [('archive', 'product', 'prod_2'), ('archive', 'price', 'price_2')]
+
+
+def test_apply_attaches_new_prices_to_the_kept_product(catalog_sync, monkeypatch):
+	products = [product('prod_old', created=100), product('prod_dup', created=200)]
+	prices = [price('price_old', 'prod_old', amount=400), price('price_dup', 'prod_dup')]
+	changes = catalog_sync.plan(SUBSCRIPTIONS, products, prices)
+	applied = []
+
+	def apply_change(change):
+		applied.append(change)
+		return SimpleNamespace(id=change.stripe_id or f'{change.kind}_created')
+
+	monkeypatch.setattr(catalog_sync, '_apply_change', apply_change)
+	catalog_sync.apply(changes, products)
+
+	# The duplicate is archived after the kept product is updated, its id must not take over the code
+	assert [change.stripe_id for change in applied if change.kind == 'product'] == ['prod_old', 'prod_dup']
+	created = [change for change in applied if change.action == 'create']
+	assert [change.params['product'] for change in created] == ['prod_old']
@@ -0,0 +1,136 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.core.config import settings
+from src.endpoints import payment
+from src.helpers.catalog import catalog_cache
+from src.helpers.payment import StripeWithAuth0
+from src.helpers.store import subscription_store
+from src.routers.payment import payment_router
+
+PRODUCT = {"product_id": "prod_essential", "product_name": "Essential", "metadata": {"limits": {"requests": 2}}}
+user_ids = (f"auth0|user{n}" for n in itertools.count())
+
+
+class FakeStripeWithAuth0:
+	"""Lists subscriptions from `subscriptions` instead of Stripe, syncing them like StripeWithAuth0 does."""
+
+	known_customer_id = StripeWithAuth0.known_customer_id
+	_cached_customer_id = StripeWithAuth0._cached_customer_id
+	sync_subscriptions = StripeWithAuth0.sync_subscriptions
+
+	def __init__(self):
+		self.customer_ids = SimpleNamespace(get=lambda key: None, set=lambda key, value: None)
+		self.subscriptions = []
+		self.syncs = 0
+
+	def _list_subscriptions(self, stripe_customer_id):
+		self.syncs += 1
+		return self.subscriptions
+
+
+class Subscription(dict):
+	"""Stripe objects are dicts that also expose their fields as attributes."""
+
+	@property
+	def status(self):
+		return self["status"]
+
+
+def subscription(customer_id, status="active"):
+	return Subscription(
+		id=f"sub_{customer_id}", customer=customer_id, status=status, current_period_end=2 ** 31,
+		items={"data": [{"price": {"id": "essential_monthly", "product": PRODUCT["product_id"]}}]},
+	)
+
+
+@pytest.fixture
+def stripe_with_auth0(monkeypatch):
+	fake = FakeStripeWithAuth0()
+
+	async def get_product(product_id):
+		return PRODUCT if product_id == PRODUCT["product_id"] else None
+
+	monkeypatch.setattr(catalog_cache, "get_product", get_product)
+	return fake
+
+
+@pytest.fixture
+def user(monkeypatch):
+	user_id = next(user_ids)
+
+	async def get_token_data(authorization):
+		return {"sub": user_id}
+
+	monkeypatch.setattr(payment, "get_token_data", get_token_data)
+	return user_id
+
+
+@pytest.fixture
+def client(stripe_with_auth0):
+	app = FastAPI()
+	app.include_router(payment_router)
+	app.dependency_overrides[payment.get_stripe_with_auth0] = lambda: stripe_with_auth0
+	return TestClient(app, headers={"Authorization": "Bearer token"})
+
+
+def test_unknown_customer_gets_402_without_calling_stripe(client, stripe_with_auth0, user):
+	assert client.get("/payment/usage").status_code == 402
+	assert stripe_with_auth0.syncs == 0
+
+
+def test_customer_without_subscription_gets_402(client, stripe_with_auth0, user):
+	subscription_store.set_customer(f"cus_{user}", auth0_sub=user)
+
+	assert client.get("/payment/usage").status_code == 402
+	assert stripe_with_auth0.syncs == 1
+
+
+def test_limit_is_enforced_with_retry_after(client, stripe_with_auth0, user):
+	customer_id = f"cus_{user}"
+	subscription_store.set_customer(customer_id, auth0_sub=user)
+	stripe_with_auth0.subscriptions = [subscription(customer_id)]
+
+	first, second, third = (client.get("/payment/usage") for _ in range(3))
+
+	assert first.status_code == 200
+	assert first.json()["subscription"] == "Essential"
+	assert first.json()["requests_remaining"] == 1
+	assert first.headers["X-RateLimit-Limit"] == "2"
+	assert second.status_code == 200
+	assert second.json()["requests_remaining"] == 0
+	assert third.status_code == 429
+	assert int(third.headers["Retry-After"]) > 0
+	assert third.headers["X-RateLimit-Remaining"] == "0"
+
+
+def test_subscriptions_are_resynced_after_the_ttl_without_webhook(client, stripe_with_auth0, user, monkeypatch):
+	monkeypatch.setattr(settings, "STRIPE_WEBHOOK_SECRET", None)
+	customer_id = f"cus_{user}"
+	subscription_store.set_customer(customer_id, auth0_sub=user)
+
+	assert client.get("/payment/usage").status_code == 402
+	# Subscribed on Stripe since: the store is trusted until the sync is older than SUBSCRIPTION_SYNC_TTL
+	stripe_with_auth0.subscriptions = [subscription(customer_id)]
+	assert client.get("/payment/usage").status_code == 402
+	assert stripe_with_auth0.syncs == 1
+
+	monkeypatch.setattr(settings, "SUBSCRIPTION_SYNC_TTL", -1)
+	assert client.get("/payment/usage").status_code == 200
+	assert stripe_with_auth0.syncs == 2
+
+
+def test_store_is_trusted_with_webhook(client, stripe_with_auth0, user, monkeypatch):
+	monkeypatch.setattr(settings, "STRIPE_WEBHOOK_SECRET", "whsec_test")
+	monkeypatch.setattr(settings, "SUBSCRIPTION_SYNC_TTL", -1)
+	customer_id = f"cus_{user}"
+	subscription_store.set_customer(customer_id, auth0_sub=user)
+	stripe_with_auth0.subscriptions = [subscription(customer_id)]
+
+	for _ in range(2):
+		assert client.get("/payment/usage").status_code == 200
+	assert stripe_with_auth0.syncs == 1